@@ -0,0 +1,858 @@
+import asyncio
+import json
+import mimetypes
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import httpx
+
+import shortcode
+from instrumentation import Instrumentation, logger
+from main import (
+    CircuitOpenError,
+    Constants,
+    MediaCache,
+    RequestTemplates,
+    RetryPolicy,
+    SessionState,
+    TokenProvider,
+    UserIdResolver,
+    build_upload_request,
+    find_connection,
+    get_media_dimensions,
+    new_upload_id,
+)
+
+
+def login_required(func):
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        await self.ensure_login()
+        return await func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class AsyncThreads:
+    """Asyncio Threads API wrapper (unofficial)
+
+    Offers the same operations as `Threads` over a pooled `httpx.AsyncClient`
+    with keep-alive, and HTTP/2 when the `h2` package is installed. The client
+    can be shared by many `AsyncThreads` instances: it never stores cookies
+    itself, each account keeps its own `SessionState` and applies it to every
+    request. Coroutines of one instance share its cookie and token state, and a
+    semaphore bounds how many of its requests are in flight at once.
+    """
+
+    MAX_REDIRECTS = 5
+
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        client=None,
+        max_concurrency=10,
+        state=None,
+        user_ids=None,
+        retry_policy=None,
+        instrumentation=None,
+        media_cache=None,
+        preprocessor=None,
+    ):
+        """Initializes a new instance of the AsyncThreads class.
+
+        Args:
+        username (str): The username to use for authentication.
+        password (str): The password to use for authentication.
+        client (httpx.AsyncClient): A client from `create_client` to share between accounts. One is created if omitted.
+        max_concurrency (int): Maximum number of requests this account has in flight at once.
+        state (SessionState): The cookie state of this account. Defaults to `encrypted_cookies.pkl`.
+        user_ids (UserIdResolver): Username to user id cache, can be shared between clients.
+        retry_policy (RetryPolicy): Retry, backoff and rate-limit handling, can be shared between clients.
+        instrumentation (Instrumentation): Receives per-phase timings and request and action counters.
+        media_cache (MediaCache): Fingerprints, dimensions and upload ids of uploaded media, can be shared between clients.
+        preprocessor (preprocess.ImagePreprocessor): Downscales and re-encodes images before they are uploaded, off the event loop.
+        """
+        self.username = username
+        self.password = password
+        self.authenticated = False
+        self.__instrumentation = instrumentation or Instrumentation()
+        self.__state = state or SessionState(instrumentation=self.__instrumentation)
+        self.__retry_policy = retry_policy or RetryPolicy()
+        self.__tokens = TokenProvider(None, self.__state)
+        self.__owns_client = client is None
+        self.__client = client or self.create_client()
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+        self.__login_lock = asyncio.Lock()
+        self.__refresh_lock = asyncio.Lock()
+        self.__refresh_task = None
+        self.__user_ids = user_ids or UserIdResolver()
+        self.__templates = RequestTemplates()
+        self.__user_id_lookups = {}
+        self.__media_cache = media_cache or MediaCache()
+        self.__preprocessor = preprocessor
+        self.__uploads = {}
+
+    @staticmethod
+    def create_client(http2=False, max_connections=100, max_keepalive_connections=20):
+        """Creates a pooled client that can be shared between accounts.
+
+        Args:
+        http2 (bool): Negotiate HTTP/2. Requires the `h2` package.
+        max_connections (int): Maximum number of open connections in the pool.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive.
+        """
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(30.0),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+
+    async def aclose(self):
+        self.__state.flush()
+        if self.__owns_client:
+            await self.__client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def ensure_login(self):
+        if self.authenticated:
+            return
+        async with self.__login_lock:
+            if self.authenticated:
+                return
+            if self.__state.load():
+                self.authenticated = True
+            elif self.username and self.password:
+                await self.login()
+            else:
+                raise PermissionError("Login required to access this method")
+
+    @asynccontextmanager
+    async def __limiter_slot(self):
+        limiter = self.__retry_policy.limiter
+        delay = 0.005
+        while not limiter.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    async def __send_once(self, method, url, headers, stream, **kwargs):
+        cookies = httpx.Cookies(self.__state.cookies)
+        request = self.__client.build_request(method, url, headers=headers, **kwargs)
+        for _ in range(self.MAX_REDIRECTS + 1):
+            cookies.set_cookie_header(request)
+            response = await self.__client.send(request, stream=stream)
+            cookies.extract_cookies(response)
+            if not response.next_request:
+                break
+            await response.aclose()
+            request = response.next_request
+            request.headers.pop("cookie", None)
+        return response
+
+    async def __send_attempt(self, method, url, endpoint, headers, stream, **kwargs):
+        instrumentation = self.__instrumentation
+        if not instrumentation.enabled:
+            return await self.__send_once(method, url, headers, stream, **kwargs)
+        status = None
+        start = time.perf_counter()
+        try:
+            response = await self.__send_once(method, url, headers, stream, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            seconds = time.perf_counter() - start
+            instrumentation.record_phase("network", seconds)
+            instrumentation.record_request(method, endpoint, status, seconds)
+
+    async def __send_request(
+        self, method, url, headers, stream=False, retry=True, **kwargs
+    ):
+        policy = self.__retry_policy
+        endpoint = policy.endpoint(url)
+        retries = policy.max_retries if retry else 0
+        attempt = 0
+        while True:
+            if not policy.breaker.allow(endpoint):
+                raise CircuitOpenError(
+                    f"Too many failures, requests to {endpoint} are suspended"
+                )
+            try:
+                async with self.__semaphore, self.__limiter_slot():
+                    response = await self.__send_attempt(
+                        method, url, endpoint, headers, stream, **kwargs
+                    )
+            except httpx.TransportError as e:
+                policy.breaker.record_failure(endpoint)
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if attempt >= retries or not (
+                    retryable or method.upper() in policy.IDEMPOTENT_METHODS
+                ):
+                    raise
+                await asyncio.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                policy.breaker.record_failure(endpoint)
+                raise
+            except BaseException:
+                # Cancelled, e.g. a sibling sidecar upload failed.
+                policy.breaker.release(endpoint)
+                raise
+            if response.status_code not in policy.RETRY_STATUSES:
+                policy.breaker.record_success(endpoint)
+                policy.limiter.on_success()
+                break
+            if response.status_code == 429:
+                policy.limiter.on_throttled()
+            policy.breaker.record_failure(endpoint)
+            if attempt >= retries or not policy.is_retryable_status(
+                method, response.status_code
+            ):
+                break
+            retry_after = policy.parse_retry_after(response.headers.get("Retry-After"))
+            await response.aclose()
+            await asyncio.sleep(policy.delay(attempt, retry_after))
+            attempt += 1
+        response.raise_for_status()
+        self.__state.mark_changed()
+        return response
+
+    async def __get_token(self, name):
+        if name == "csrftoken":
+            return self.__state.get("csrftoken", "")
+        expires_at = self.__tokens.expires_at(name)
+        now = time.time()
+        if now >= expires_at:
+            async with self.__refresh_lock:
+                if time.time() >= self.__tokens.expires_at(name):
+                    await self.__refresh_tokens()
+        elif now >= expires_at - self.__tokens.refresh_margin:
+            if self.__refresh_task is None or self.__refresh_task.done():
+                self.__refresh_task = asyncio.create_task(
+                    self.__refresh_in_background()
+                )
+        return self.__tokens.peek(name)
+
+    async def __refresh_in_background(self):
+        async with self.__refresh_lock:
+            await self.__refresh_tokens()
+
+    async def __refresh_tokens(self):
+        scanner = self.__tokens.scanner()
+        try:
+            response = await self.__send_request(
+                "GET", Constants.BASE_URL, headers=Constants.BASIC_HEADERS, stream=True
+            )
+            try:
+                async for chunk in response.aiter_bytes(self.__tokens.SCAN_CHUNK_SIZE):
+                    if scanner.feed(chunk):
+                        break
+            finally:
+                await response.aclose()
+        except Exception as e:
+            logger.warning(
+                "Failed to refresh tokens: %s", e, extra={"event": "token_refresh"}
+            )
+            return False
+        self.__tokens.store(scanner.found)
+        return "fb_dtsg" in scanner.found
+
+    async def __graphql_headers(self, **extra):
+        return {
+            **Constants.BASIC_HEADERS,
+            "x-asbd-id": "129477",
+            "x-csrftoken": await self.__get_token("csrftoken"),
+            "x-ig-app-id": "238260118697367",
+            "x-instagram-ajax": "0",
+            "Referer": "https://www.threads.net/",
+            "Referrer-Policy": "origin-when-cross-origin",
+            **extra,
+        }
+
+    async def __send_graphql_request(self, headers, data):
+        url = Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT
+        response = await self.__send_request("POST", url, headers=headers, data=data)
+        if self.__tokens.is_auth_error(response):
+            sent = data["fb_dtsg"]
+            sent = sent[0] if isinstance(sent, list) else sent
+            async with self.__refresh_lock:
+                # Coroutines rejected with the same token share one refresh.
+                refreshed = (
+                    not self.__tokens.needs_refresh(sent)
+                    or await self.__refresh_tokens()
+                )
+            if refreshed:
+                fb_dtsg = self.__tokens.peek("fb_dtsg")
+                data = {
+                    **data,
+                    "fb_dtsg": (
+                        [fb_dtsg] if isinstance(data["fb_dtsg"], list) else fb_dtsg
+                    ),
+                }
+                headers = {
+                    **headers,
+                    "x-csrftoken": await self.__get_token("csrftoken"),
+                }
+                response = await self.__send_request(
+                    "POST", url, headers=headers, data=data
+                )
+        return response
+
+    async def __fetch_notifications(self, cursor, page_size):
+        headers, data = self.__templates.prepare_query(
+            "GET_NOTIFICATION",
+            {"first": page_size, "after": cursor},
+            await self.__get_token("fb_dtsg"),
+            await self.__get_token("csrftoken"),
+            self.__tokens.peek("lsd"),
+        )
+        response = await self.__send_graphql_request(headers=headers, data=data)
+        payload = self.__json(response)
+        if payload.get("errors"):
+            raise ValueError(f"Failed to fetch notifications: {payload['errors']}")
+        return find_connection(payload.get("data"))
+
+    async def iter_notification_pages(self, cursor=None, page_size=20, max_pages=None):
+        """Yields pages of notifications, fetching the next page in the background.
+
+        Args:
+        cursor (str): Cursor to resume from, as yielded with an earlier page.
+        page_size (int): Number of notifications requested per page.
+        max_pages (int): Stop after this many pages.
+
+        Yields:
+        tuple: The notifications of a page and the cursor to resume after it.
+        """
+        await self.ensure_login()
+        task = asyncio.ensure_future(self.__fetch_notifications(cursor, page_size))
+        pages = 0
+        try:
+            while task is not None:
+                nodes, cursor, has_next_page = await task
+                pages += 1
+                task = None
+                if (
+                    has_next_page
+                    and cursor
+                    and (max_pages is None or pages < max_pages)
+                ):
+                    task = asyncio.ensure_future(
+                        self.__fetch_notifications(cursor, page_size)
+                    )
+                yield nodes, cursor
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def iter_notifications(self, cursor=None, page_size=20, max_pages=None):
+        """Yields notifications one by one, see `iter_notification_pages`."""
+        async for nodes, _ in self.iter_notification_pages(
+            cursor, page_size, max_pages
+        ):
+            for node in nodes:
+                yield node
+
+    @login_required
+    async def mark_read(self, notification_ids, batch_size=50):
+        """Marks notifications as read, sending the ids in batches.
+
+        Raises ValueError while the doc id of the mark-read query is the one of
+        LIKE, see `Threads.mark_read`.
+
+        Returns:
+        bool: True if every batch was acknowledged.
+        """
+        self.__templates.check_distinct("MARK_NOTIFICATIONS_READ", "LIKE")
+        notification_ids = list(notification_ids)
+        ok = True
+        for start in range(0, len(notification_ids), batch_size):
+            headers, data = self.__templates.prepare_query(
+                "MARK_NOTIFICATIONS_READ",
+                {"notification_ids": notification_ids[start : start + batch_size]},
+                await self.__get_token("fb_dtsg"),
+                await self.__get_token("csrftoken"),
+                self.__tokens.peek("lsd"),
+            )
+            response = await self.__send_graphql_request(headers=headers, data=data)
+            errors = self.__json(response).get("errors")
+            self.__instrumentation.record_action("MARK_NOTIFICATIONS_READ", not errors)
+            if errors:
+                logger.warning(
+                    "Failed to mark notifications as read: %s",
+                    errors,
+                    extra={"event": "action", "action": "MARK_NOTIFICATIONS_READ"},
+                )
+                ok = False
+        return ok
+
+    async def login(self):
+        if not self.username or not self.password:
+            raise ValueError("Username and password are required to login")
+        await self.__send_request(
+            "GET", Constants.BASE_URL + "/login", headers=Constants.BASIC_HEADERS
+        )
+        csrf_token = self.__state.get("csrftoken", "")
+
+        headers = {
+            "x-asbd-id": Constants.LOGIN_X_ASB_ID,
+            "x-csrftoken": csrf_token,
+            "x-ig-app-id": Constants.LOGIN_X_IG_APP_ID,
+            "x-instagram-ajax": "0",
+            "Referer": "https://www.threads.net/login",
+            "Referrer-Policy": "origin-when-cross-origin",
+        }
+
+        payload = {
+            "username": self.username,
+            "enc_password": f"#PWD_INSTAGRAM_BROWSER:0:{int(time.time() * 1000)}:{self.password}",
+            "queryParams": {},
+            "optIntoOneTap": "false",
+            "csrfmiddlewaretoken": csrf_token,
+        }
+
+        response = await self.__send_request(
+            "POST",
+            Constants.BASE_URL + Constants.LOGIN_ENDPOINT,
+            headers=headers,
+            data=payload,
+        )
+
+        extra = {"event": "login", "username": self.username}
+        try:
+            if self.__json(response)["authenticated"] == True:
+                self.authenticated = True
+                logger.info("Logged in as %s", self.username, extra=extra)
+                self.__state.flush()
+            else:
+                logger.warning("Login failed for %s", self.username, extra=extra)
+        except Exception:
+            logger.exception("Login failed for %s", self.username, extra=extra)
+        return self.authenticated
+
+    @login_required
+    async def get_user_id(self, username):
+        found, user_id = self.__user_ids.lookup(username)
+        if found:
+            return user_id
+        key = username.lower()
+        lookup = self.__user_id_lookups.get(key)
+        if lookup is None:
+            lookup = asyncio.ensure_future(self.__search_user_id(username))
+            self.__user_id_lookups[key] = lookup
+            lookup.add_done_callback(lambda _: self.__user_id_lookups.pop(key, None))
+        return await asyncio.shield(lookup)
+
+    @login_required
+    async def resolve_user_ids(self, usernames):
+        """Resolves many usernames at once.
+
+        Returns:
+        dict: The user id (or None) of each distinct username.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        user_ids = await asyncio.gather(*(self.get_user_id(name) for name in usernames))
+        return dict(zip(usernames, user_ids))
+
+    async def __search_user_id(self, username):
+        csrf_token = await self.__get_token("csrftoken")
+        addional_headers = {
+            "x-csrftoken": csrf_token,
+        }
+
+        response = await self.__send_request(
+            "GET",
+            "https://www.instagram.com/web/search/topsearch/",
+            headers={**Constants.BASIC_HEADERS, **addional_headers},
+            params={"query": username.lower()},
+        )
+        user_id = None
+        for item in response.json().get("users"):
+            # Usernames are case-insensitive and cached lowercased.
+            if item["user"]["username"].lower() == username.lower():
+                user_id = item["user"]["pk"]
+                break
+        return self.__user_ids.store(username, user_id)
+
+    async def __mutate(self, doc_name, target):
+        with self.__instrumentation.phase("token_fetch"):
+            fb_dtsg = await self.__get_token("fb_dtsg")
+            csrftoken = await self.__get_token("csrftoken")
+            lsd = self.__tokens.peek("lsd")
+        with self.__instrumentation.phase("serialization"):
+            headers, data = self.__templates.prepare(
+                doc_name, target, fb_dtsg, csrftoken, lsd
+            )
+        return await self.__send_graphql_request(headers=headers, data=data)
+
+    def __json(self, response):
+        with self.__instrumentation.phase("serialization"):
+            return response.json()
+
+    async def __perform_action(self, doc_name, target, action_name):
+        response = await self.__mutate(doc_name, target)
+        errors = self.__json(response).get("errors")
+        self.__instrumentation.record_action(doc_name, not errors)
+
+        extra = {"event": "action", "action": doc_name, "target": target}
+        if not errors:
+            logger.info("%s succeeded", action_name, extra=extra)
+            return True
+        else:
+            logger.warning(
+                "%s failed: %s", action_name, errors, extra={**extra, "errors": errors}
+            )
+            return False
+
+    async def __perform_user_action(self, username, user_id, doc_name, action_name):
+        if not username and not user_id:
+            raise ValueError("Either username or user_id is required")
+        if username:
+            user_id = await self.get_user_id(username)
+        return await self.__perform_action(doc_name, user_id, action_name)
+
+    @login_required
+    async def like(self, post_id):
+        return await self.__perform_action("LIKE", post_id, "like")
+
+    @login_required
+    async def unlike(self, post_id):
+        return await self.__perform_action("UNLIKE", post_id, "unlike")
+
+    async def __upload_image(
+        self,
+        media_path,
+        supported_types=["image", "video"],
+        is_sidecar=False,
+        reuse=True,
+        reused=None,
+        claims=None,
+        position=0,
+    ):
+        """Uploads one image or video and returns its upload id.
+
+        Args:
+        reuse (bool): Use an upload id from the media cache if there is one.
+        reused (set): Collects the upload ids that were served from the cache.
+        claims (dict): Content digest to the position of the child that claimed it, shared by the children of one sidecar.
+        position (int): The position of this child in the sidecar.
+        """
+        if not os.path.exists(media_path):
+            raise FileNotFoundError("The path provided is not a valid file path.")
+        mime_type, _ = mimetypes.guess_type(media_path)
+
+        if not mime_type or mime_type.split("/")[0] not in supported_types:
+            raise ValueError("The file type is not supported.")
+
+        cache = self.__media_cache
+        digest = await asyncio.to_thread(cache.fingerprint, media_path)
+        cover_path = None
+        if self.__preprocessor and self.__preprocessor.accepts(mime_type):
+            prepared = await asyncio.wrap_future(
+                self.__preprocessor.submit(media_path, digest)
+            )
+            media_path, mime_type = prepared.path, prepared.mime_type
+            cover_path = prepared.cover_path
+            digest = await asyncio.to_thread(cache.fingerprint, media_path)
+            cache.dimensions(digest, lambda: (prepared.width, prepared.height))
+        scope = f"{self.__state.get('ds_user_id', '')}:{int(is_sidecar)}"
+        if claims is not None and claims.setdefault(digest, position) != position:
+            # The same content in another child of this sidecar needs an
+            # upload id of its own, so it neither reuses nor joins an upload.
+            upload_id = await self.__send_media(
+                media_path, mime_type, digest, is_sidecar, cover_path
+            )
+            cache.store_upload(scope, digest, upload_id)
+            return upload_id
+        if reuse:
+            upload_id = cache.lookup_upload(scope, digest)
+            if upload_id is not None:
+                if reused is not None:
+                    reused.add(upload_id)
+                return upload_id
+        # Concurrent uploads of the same content share one request.
+        key = (scope, digest)
+        upload = self.__uploads.get(key)
+        if upload is None:
+            upload = asyncio.ensure_future(
+                self.__send_media(media_path, mime_type, digest, is_sidecar, cover_path)
+            )
+            self.__uploads[key] = upload
+            upload.add_done_callback(lambda _: self.__uploads.pop(key, None))
+        upload_id = await asyncio.shield(upload)
+        cache.store_upload(scope, digest, upload_id)
+        return upload_id
+
+    async def __send_media(
+        self, media_path, mime_type, digest, is_sidecar, cover_path=None
+    ):
+        width, height = await asyncio.to_thread(
+            self.__media_cache.dimensions,
+            digest,
+            lambda: get_media_dimensions(media_path),
+        )
+        timestamp = new_upload_id()
+
+        URL, headers = build_upload_request(
+            media_path,
+            mime_type,
+            timestamp,
+            width,
+            height,
+            is_sidecar,
+            extract_cover_frame=cover_path is None,
+        )
+        offset = await self.__rupload(media_path, URL, headers)
+        logger.debug(
+            "Uploaded %s",
+            media_path,
+            extra={"event": "upload", "upload_id": timestamp, "offset": offset},
+        )
+        if cover_path:
+            URL, headers = build_upload_request(
+                cover_path, "image/jpeg", timestamp, width, height, is_sidecar
+            )
+            await self.__rupload(cover_path, URL, headers)
+        return timestamp
+
+    async def __rupload(self, media_path, URL, headers):
+        """Sends a file to a rupload URL, resuming after failed attempts.
+
+        Returns:
+        int: The offset the last attempt started from.
+        """
+        size = int(headers["x-entity-length"])
+        offset = 0
+        for attempt in range(Constants.UPLOAD_RETRIES + 1):
+            try:
+                # Raises for error statuses, the body is not needed.
+                await self.__send_request(
+                    "POST",
+                    URL,
+                    headers={
+                        **headers,
+                        "offset": str(offset),
+                        "content-length": str(size - offset),
+                    },
+                    content=self.__read_chunks(media_path, offset),
+                    retry=False,
+                )
+                break
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if attempt == Constants.UPLOAD_RETRIES or (
+                    status and status not in RetryPolicy.RETRY_STATUSES
+                ):
+                    raise
+                await asyncio.sleep(self.__retry_policy.delay(attempt))
+                offset = await self.__get_upload_offset(URL, headers)
+        return offset
+
+    async def __upload_media(self, media_path, max_workers, reuse=True, reused=None):
+        """Uploads the media of a thread and returns their upload ids.
+
+        Upload ids served from the media cache are added to `reused`.
+        """
+        if len(media_path) > 1:
+            return await self.__upload_sidecar(media_path, max_workers, reuse, reused)
+        return [
+            await self.__upload_image(path, reuse=reuse, reused=reused)
+            for path in media_path
+        ]
+
+    async def __upload_sidecar(self, media_path, max_workers, reuse=True, reused=None):
+        """Uploads the children of a sidecar concurrently.
+
+        Returns the upload ids in the order of `media_path`. If an upload fails,
+        the other uploads are cancelled and the error is raised.
+        """
+        semaphore = asyncio.Semaphore(max_workers)
+        claims = {}
+
+        async def upload(position, path):
+            async with semaphore:
+                return await self.__upload_image(
+                    path,
+                    is_sidecar=True,
+                    reuse=reuse,
+                    reused=reused,
+                    claims=claims,
+                    position=position,
+                )
+
+        tasks = [
+            asyncio.ensure_future(upload(position, path))
+            for position, path in enumerate(media_path)
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    @staticmethod
+    async def __read_chunks(media_path, offset):
+        with open(media_path, "rb") as file:
+            file.seek(offset)
+            while True:
+                chunk = await asyncio.to_thread(file.read, Constants.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def __get_upload_offset(self, url, headers):
+        """Asks the upload endpoint how many bytes it has already received."""
+        try:
+            response = await self.__send_request("GET", url, headers=headers)
+            return int(response.json().get("offset", 0))
+        except (httpx.HTTPError, ValueError):
+            return 0
+
+    @login_required
+    async def create_thread(
+        self,
+        message: str,
+        media_path: list = [],
+        reply_to: str = None,
+        quoted_thread_id: str = None,
+        max_upload_workers: int = 4,
+    ):
+        media_path = media_path or []
+        reused = set()
+        upload_ids = await self.__upload_media(
+            media_path, max_upload_workers, reused=reused
+        )
+        try:
+            return await self.__send_configure(
+                message, upload_ids, reply_to, quoted_thread_id
+            )
+        except httpx.HTTPStatusError as e:
+            # Upload ids reused from the media cache may have expired on the server.
+            if not 400 <= e.response.status_code < 500 or not reused:
+                raise
+            self.__media_cache.forget_uploads(reused)
+        logger.info("Cached upload ids were rejected, uploading the media again")
+        upload_ids = await self.__upload_media(
+            media_path, max_upload_workers, reuse=False
+        )
+        return await self.__send_configure(
+            message, upload_ids, reply_to, quoted_thread_id
+        )
+
+    async def __send_configure(self, message, upload_ids, reply_to, quoted_thread_id):
+        text_post_app_info = (
+            {"reply_control": 0, "reply_id": f"{reply_to}"}
+            if reply_to
+            else {"reply_control": 0}
+        )
+        if quoted_thread_id:
+            text_post_app_info["quoted_post_id"] = quoted_thread_id
+        headers = await self.__graphql_headers()
+        kwargs = {}
+        if len(upload_ids) > 1:
+            URL = Constants.BASE_URL + Constants.CREAET_SIDECAR_MEDIA_THREAD_ENDPOINT
+            children_metadata = [
+                {"upload_id": f"{upload_id}"} for upload_id in upload_ids
+            ]
+            payload = {
+                "caption": message,
+                "children_metadata": children_metadata,
+                "client_sidecar_id": new_upload_id(),
+                "is_threads": True,
+                "text_post_app_info": json.dumps(text_post_app_info),
+            }
+            with self.__instrumentation.phase("serialization"):
+                kwargs["content"] = json.dumps(payload)
+
+        elif upload_ids:
+            URL = Constants.BASE_URL + Constants.CREATE_SINGLE_MEDIA_THREAD_ENDPOINT
+            kwargs["data"] = {
+                "caption": message,
+                "is_meta_only_post": "",
+                "is_paid_partnership": "",
+                "text_post_app_info": json.dumps(text_post_app_info),
+                "upload_id": f"{upload_ids[0]}",
+            }
+
+        else:
+            URL = Constants.BASE_URL + Constants.CREATE_TEXT_ONLY_THREAD_ENDPOINT
+            kwargs["data"] = {
+                "caption": message,
+                "is_meta_only_post": "",
+                "is_paid_partnership": "",
+                "publish_mode": "text_post",
+                "text_post_app_info": json.dumps(text_post_app_info),
+                "upload_id": f"{new_upload_id()}",
+            }
+
+        response = await self.__send_request("POST", URL, headers=headers, **kwargs)
+        payload = self.__json(response)
+        logger.info(
+            "Thread created", extra={"event": "create_thread", "response": payload}
+        )
+        return payload
+
+    @login_required
+    async def delete_thread(self, thread_id):
+        post_id = shortcode.to_post_id(thread_id, self.__state.get("ds_user_id", ""))
+        response = await self.__mutate("DELETE", post_id)
+        deleted = bool(self.__json(response))
+        self.__instrumentation.record_action("DELETE", deleted)
+
+        extra = {"event": "action", "action": "DELETE", "target": post_id}
+        if deleted:
+            logger.info("Thread deleted", extra=extra)
+        else:
+            logger.warning("Failed to delete thread", extra=extra)
+        return deleted
+
+    @login_required
+    async def repost(self, thread_id):
+        return await self.__perform_action("REPOST", thread_id, "repost")
+
+    @login_required
+    async def unrepost(self, thread_id):
+        return await self.__perform_action("UNREPOST", thread_id, "unrepost")
+
+    @login_required
+    async def follow(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(username, user_id, "FOLLOW", "follow")
+
+    @login_required
+    async def unfollow(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(
+            username, user_id, "UNFOLLOW", "unfollow"
+        )
+
+    @login_required
+    async def block(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(username, user_id, "BLOCK", "block")
+
+    @login_required
+    async def unblock(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(username, user_id, "UNBLOCK", "unblock")
+
+    @login_required
+    async def mute(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(username, user_id, "MUTE", "mute")
+
+    @login_required
+    async def unmute(self, username: str = None, user_id: str = None):
+        return await self.__perform_user_action(username, user_id, "UNMUTE", "unmute")
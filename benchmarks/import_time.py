@@ -0,0 +1,72 @@
+"""Measures how long `import main` takes and which heavy modules it pulls in.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 300]
+
+Each run imports `main` in a fresh interpreter. The script exits with status 1
+if the median import time exceeds the budget or if one of the dependencies that
+should only be loaded on demand was imported.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = [
+    "moviepy",
+    "PIL",
+    "faker",
+    "bs4",
+    "cryptography",
+    "httpx",
+    "sqlite3",
+    "prometheus_client",
+    "opentelemetry",
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure():
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=ROOT,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    median_ms = statistics.median(result["seconds"] for result in results) * 1000
+    loaded = {name.split(".")[0] for name in results[-1]["modules"]}
+    eager = [name for name in LAZY_MODULES if name in loaded]
+
+    print(f"import main: median {median_ms:.1f} ms over {args.runs} runs")
+    if eager:
+        print(f"loaded at import time: {', '.join(eager)}")
+
+    failed = median_ms > args.budget_ms or bool(eager)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""A local stand-in for the threads.net and instagram.com endpoints used by `Threads`.
+
+The server answers the login, token page, `/api/graphql`, `rupload_ig*`,
+`configure_*` and topsearch endpoints with canned responses, optionally after
+a delay and with a share of requests failing. `mock_session()` returns a
+`requests.Session` that sends every request for the real hosts to the server,
+so `Threads(session=mock_session(server))` runs fully offline.
+
+Usage:
+    with MockThreadsServer(latency=0.005, failure_rate=0.01) as server:
+        threads = Threads("user", "password", session=mock_session(server))
+
+The server can also run in its own process, so that it does not compete with
+the client for the GIL, and be used through `RemoteMockServer`:
+    python benchmarks/mock_server.py --port 8765 [--latency-ms 20]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_session  # noqa: E402
+
+MOCKED_HOSTS = ["https://www.threads.net", "https://www.instagram.com"]
+
+FB_DTSG = "mock-fb-dtsg:1"
+LSD = "mock-lsd"
+USER_ID = "52149867531"
+
+TOKEN_PAGE = (
+    "<html><head><script>"
+    f'["DTSGInitialData",[],{{"token":"{FB_DTSG}"}},258],'
+    f'["LSD",[],{{"token":"{LSD}"}},323]'
+    "</script></head><body>" + "x" * 32768 + "</body></html>"
+).encode()
+
+LOGIN_COOKIES = {
+    "csrftoken": "mock-csrftoken",
+    "sessionid": f"{USER_ID}%3Amock-session",
+    "ds_user_id": USER_ID,
+    "mid": "mock-mid",
+    "ig_did": "mock-ig-did",
+    "rur": "mock-rur",
+}
+
+STATS_PATH = "/__mock__/stats"
+RUPLOAD_PATH = re.compile(r"^/rupload_ig(photo|video)/fb_uploader_(\d+)$")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected.
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockThreadsServer:
+    """Threaded HTTP server emulating the Threads web API.
+
+    Args:
+    latency (float): Seconds to wait before answering each request.
+    jitter (float): Extra random delay of up to this many seconds.
+    failure_rate (float): Share of requests answered with `failure_status`.
+    failure_status (int): Status code of injected failures, e.g. 500 or 429.
+    retry_after (float): `Retry-After` value sent with injected 429 and 503 responses.
+    seed (int): Seed for the jitter and failure injection.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        failure_rate=0.0,
+        failure_status=500,
+        retry_after=0,
+        seed=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.failures = Counter()
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__server = _Server((host, port), self.__handler())
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True
+        )
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        if self.__thread:
+            self.__thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self.__lock:
+            self.requests.clear()
+            self.failures.clear()
+
+    def _record(self, endpoint):
+        """Counts a request and decides whether it should fail."""
+        with self.__lock:
+            self.requests[endpoint] += 1
+            delay = self.latency + self.__random.random() * self.jitter
+            failed = self.__random.random() < self.failure_rate
+            if failed:
+                self.failures[endpoint] += 1
+        return delay, failed
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.handle_request("GET")
+
+            def do_POST(self):
+                self.handle_request("POST")
+
+            def handle_request(self, method):
+                url = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                if url.path == STATS_PATH:
+                    if method == "POST":
+                        server.reset_counters()
+                    stats = {
+                        "requests": server.requests,
+                        "failures": server.failures,
+                    }
+                    self.respond(200, json.dumps(stats).encode())
+                    return
+                route = server._route(method, url.path)
+                delay, failed = server._record(route.__name__)
+                if delay:
+                    time.sleep(delay)
+                if failed:
+                    headers = {}
+                    if server.failure_status in (429, 503):
+                        headers["Retry-After"] = str(server.retry_after)
+                    self.respond(server.failure_status, b"{}", headers=headers)
+                    return
+                status, payload, cookies = route(url, body)
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode()
+                self.respond(status, payload, cookies=cookies)
+
+            def respond(self, status, payload, cookies=None, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                for name, value in (cookies or {}).items():
+                    self.send_header("Set-Cookie", f"{name}={value}; Path=/")
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def _route(self, method, path):
+        if path in ("/", "/login"):
+            return self.token_page
+        if path == "/api/v1/web/accounts/login/ajax/":
+            return self.login
+        if path == "/api/graphql":
+            return self.graphql
+        if RUPLOAD_PATH.match(path):
+            return self.upload_offset if method == "GET" else self.upload
+        if path.startswith("/api/v1/media/configure_"):
+            return self.configure
+        if path == "/web/search/topsearch/":
+            return self.topsearch
+        return self.not_found
+
+    def token_page(self, url, body):
+        return 200, TOKEN_PAGE, {"csrftoken": LOGIN_COOKIES["csrftoken"]}
+
+    def login(self, url, body):
+        form = parse_qs(body.decode())
+        if not form.get("username") or not form.get("enc_password"):
+            return 400, {"authenticated": False, "status": "fail"}, None
+        payload = {"authenticated": True, "user": True, "userId": USER_ID}
+        return 200, payload, LOGIN_COOKIES
+
+    def graphql(self, url, body):
+        form = parse_qs(body.decode())
+        if form.get("fb_dtsg") != [FB_DTSG]:
+            error = {"code": 1357004, "message": "Invalid fb_dtsg"}
+            return 200, {"errors": [error]}, None
+        return 200, {"data": {"doc_id": form.get("doc_id", [""])[0]}}, None
+
+    def upload(self, url, body):
+        upload_id = RUPLOAD_PATH.match(url.path).group(2)
+        return 200, {"upload_id": upload_id, "status": "ok", "size": len(body)}, None
+
+    def upload_offset(self, url, body):
+        return 200, {"offset": 0}, None
+
+    def configure(self, url, body):
+        media = {"pk": str(random.getrandbits(62)), "code": "CuXFPIeLLod"}
+        return 200, {"media": media, "status": "ok"}, None
+
+    def topsearch(self, url, body):
+        username = parse_qs(url.query).get("query", [""])[0]
+        user = {"username": username, "pk": str(abs(hash(username)) % 10**11)}
+        return 200, {"users": [{"position": 0, "user": user}]}, None
+
+    def not_found(self, url, body):
+        return 404, {"status": "fail", "message": "Not found"}, None
+
+
+class LocalAdapter(HTTPAdapter):
+    """Transport adapter that sends requests for the real hosts to a local server.
+
+    Cookies are still recorded against the original host, so the client
+    behaves as if it talked to threads.net.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        local = request.copy()
+        parts = urlsplit(request.url)
+        local.url = urlunsplit(
+            (self.base.scheme, self.base.netloc, parts.path, parts.query, "")
+        )
+        response = super().send(local, **kwargs)
+        response.request = request
+        response.url = request.url
+        return response
+
+
+def mock_session(server, pool_maxsize=10):
+    """Returns a session configured like `create_session` that talks to `server`."""
+    session = create_session(pool_maxsize)
+    adapter = LocalAdapter(
+        server.url, pool_connections=len(MOCKED_HOSTS), pool_maxsize=pool_maxsize
+    )
+    for host in MOCKED_HOSTS:
+        session.mount(host, adapter)
+    return session
+
+
+class RemoteMockServer:
+    """Client for a mock server running in another process."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.__session = requests.Session()
+        self.__session.trust_env = False
+
+    def __stats(self, method="GET"):
+        response = self.__session.request(method, self.url + STATS_PATH)
+        response.raise_for_status()
+        return response.json()
+
+    @property
+    def requests(self):
+        return Counter(self.__stats()["requests"])
+
+    @property
+    def failures(self):
+        return Counter(self.__stats()["failures"])
+
+    def reset_counters(self):
+        self.__stats("POST")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    server = MockThreadsServer(
+        args.host,
+        args.port,
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        seed=args.seed,
+    )
+    with server:
+        print(f"Serving on {server.url}", flush=True)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
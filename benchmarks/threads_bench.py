@@ -0,0 +1,281 @@
+"""Benchmarks the `Threads` client against the local mock server, without network access.
+
+Usage:
+    python benchmarks/threads_bench.py [--iterations 200] [--latency-ms 0]
+        [--failure-rate 0] [--scenarios like follow] [--threads 1]
+        [--json results.json]
+        [--baseline results.json --tolerance 0.25]
+
+For each scenario the script reports throughput, p50/p99 latency and the peak
+memory allocated per operation, and with `--phases` the time per operation
+spent fetching tokens, on cookie I/O, on serialization and on the network. With `--baseline` it exits with status 1 if
+the throughput of any scenario dropped by more than `--tolerance` compared to
+a previous `--json` run, or if an operation failed despite the retries.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from instrumentation import Instrumentation, MetricsRecorder  # noqa: E402
+from main import (  # noqa: E402
+    MediaCache,
+    RetryPolicy,
+    SessionCodec,
+    SessionState,
+    Threads,
+    UserIdResolver,
+)
+from mock_server import MockThreadsServer, RemoteMockServer, mock_session  # noqa: E402
+
+MEMORY_ITERATIONS = 20
+
+
+def make_png(path, width, height, size):
+    """Writes a PNG with a valid header and `size` bytes of image data."""
+
+    def chunk(kind, data):
+        crc = zlib.crc32(kind + data)
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", header))
+        f.write(chunk(b"IDAT", os.urandom(size)))
+        f.write(chunk(b"IEND", b""))
+    return path
+
+
+class Bench:
+    def __init__(self, server, workdir, media_size, metrics=None, workers=1):
+        self.server = server
+        self.workdir = workdir
+        self.workers = workers
+        self.metrics = metrics
+        self.instrumentation = Instrumentation(*([metrics] if metrics else []))
+        self.retry_policy = RetryPolicy(backoff=0.01, max_backoff=0.1)
+        self.images = [
+            make_png(os.path.join(workdir, f"image{i}.png"), 1080, 1350, media_size)
+            for i in range(3)
+        ]
+        self.codec = SessionCodec(Fernet.generate_key().decode())
+        # Upload ids are not reused, so that every create_thread uploads its media.
+        self.media_cache = MediaCache(upload_ttl=0)
+        self.states = []
+
+    def client(self, login=True):
+        state = SessionState(
+            os.path.join(self.workdir, f"{len(self.states)}.session"),
+            instrumentation=self.instrumentation,
+            codec=self.codec,
+        )
+        self.states.append(state)
+        threads = Threads(
+            "bench_user",
+            "bench_password",
+            user_ids=UserIdResolver(),
+            state=state,
+            retry_policy=self.retry_policy,
+            session=mock_session(self.server, pool_maxsize=max(10, self.workers)),
+            instrumentation=self.instrumentation,
+            media_cache=self.media_cache,
+        )
+        if login:
+            threads.login()
+        return threads
+
+    def close(self):
+        """Writes pending sessions while the work directory still exists."""
+        for state in self.states:
+            state.flush()
+
+    def scenarios(self):
+        """Returns the action of each scenario, or None to benchmark the login itself."""
+        return {
+            "login": None,
+            "like": lambda i, threads: threads.like(str(i)),
+            "follow": lambda i, threads: threads.follow(username=f"user{i}"),
+            "create_thread_text": lambda i, threads: threads.create_thread(
+                f"Thread {i}"
+            ),
+            "create_thread_single": lambda i, threads: threads.create_thread(
+                f"Thread {i}", self.images[:1]
+            ),
+            "create_thread_sidecar": lambda i, threads: threads.create_thread(
+                f"Thread {i}", self.images
+            ),
+        }
+
+    def run(self, name, iterations):
+        action = self.scenarios()[name]
+        if action is None:
+            operation = lambda i: self.client()
+        else:
+            threads = self.client()
+            operation = lambda i: action(i, threads)
+
+        def timed(i):
+            start = time.perf_counter()
+            try:
+                operation(i)
+                ok = True
+            except Exception:
+                ok = False
+            return time.perf_counter() - start, ok
+
+        self.server.reset_counters()
+        if self.metrics:
+            self.metrics.reset()
+        started = time.perf_counter()
+        if self.workers > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                outcomes = list(pool.map(timed, range(iterations)))
+        else:
+            outcomes = [timed(i) for i in range(iterations)]
+        elapsed = time.perf_counter() - started
+        latencies = [seconds for seconds, _ in outcomes]
+        errors = sum(not ok for _, ok in outcomes)
+        phases = {}
+        if self.metrics:
+            phases = {
+                name: timing["total"] / iterations * 1000
+                for name, timing in self.metrics.snapshot()["phases"].items()
+            }
+        requests_sent = sum(self.server.requests.values())
+        failures = sum(self.server.failures.values())
+
+        tracemalloc.start()
+        peaks = []
+        for i in range(iterations, iterations + min(iterations, MEMORY_ITERATIONS)):
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                operation(i)
+            except Exception:
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            "ops_per_sec": iterations / elapsed,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "peak_kib": statistics.median(peaks) / 1024,
+            "requests_per_op": requests_sent / iterations,
+            "injected_failures": failures,
+            "errors": errors,
+            "phase_ms": phases,
+        }
+
+
+def percentile(sorted_values, percent):
+    index = round(percent / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        change = result["ops_per_sec"] / previous["ops_per_sec"] - 1
+        if change < -tolerance:
+            regressions.append(f"{name}: {change:+.0%} ops/sec")
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} failed operations")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--media-kib", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", nargs="+")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Share one client between this many threads.",
+    )
+    parser.add_argument(
+        "--phases",
+        action="store_true",
+        help="Also report the time per operation spent in each client phase.",
+    )
+    parser.add_argument(
+        "--server-url",
+        help="Use a mock server started with benchmarks/mock_server.py instead of "
+        "one in this process. Latency and failures are then set on the server.",
+    )
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--baseline", help="Results of a previous --json run.")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    if args.server_url:
+        server = RemoteMockServer(args.server_url)
+    else:
+        server = MockThreadsServer(
+            latency=args.latency_ms / 1000,
+            jitter=args.jitter_ms / 1000,
+            failure_rate=args.failure_rate,
+            failure_status=args.failure_status,
+            seed=args.seed,
+        )
+    results = {}
+    with server, tempfile.TemporaryDirectory() as workdir:
+        metrics = MetricsRecorder() if args.phases else None
+        bench = Bench(server, workdir, args.media_kib * 1024, metrics, args.threads)
+        names = args.scenarios or list(bench.scenarios())
+        print(
+            f"{'scenario':<24}{'ops/sec':>10}{'p50 ms':>10}{'p99 ms':>10}"
+            f"{'peak KiB':>10}{'req/op':>8}{'failed':>8}{'errors':>8}"
+        )
+        for name in names:
+            result = bench.run(name, args.iterations)
+            results[name] = result
+            print(
+                f"{name:<24}{result['ops_per_sec']:>10.1f}{result['p50_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['peak_kib']:>10.1f}"
+                f"{result['requests_per_op']:>8.2f}{result['injected_failures']:>8}"
+                f"{result['errors']:>8}"
+            )
+            for phase, ms in sorted(result["phase_ms"].items()):
+                print(f"  {phase:<22}{ms:>10.3f} ms/op")
+        bench.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Timing, counters and structured logging for the Threads clients.
+
+An `Instrumentation` forwards three kinds of events to its exporters:
+
+- phases: how long the client spent in `token_fetch`, `cookie_io`,
+  `serialization` and `network`. Phases can nest, e.g. a token fetch includes
+  the network time of the page it downloads.
+- requests: one per HTTP attempt, by method, endpoint and status.
+- actions: one per GraphQL mutation, by `Constants.DOC_IDS` name and outcome.
+
+Without exporters every hook is a no-op, so an uninstrumented client only pays
+for an attribute check. Exporters are plain objects with `phase`, `request`
+and `action` methods; `MetricsRecorder`, `LoggingExporter`,
+`PrometheusExporter` and `OpenTelemetryExporter` are provided.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger("threads")
+
+
+class _NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.record_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation:
+    """Dispatches timings and counters to a list of exporters.
+
+    Example:
+    metrics = MetricsRecorder()
+    threads = Threads(username, password, instrumentation=Instrumentation(metrics))
+    threads.like(post_id)
+    print(metrics.snapshot())
+    """
+
+    def __init__(self, *exporters):
+        self.exporters = list(exporters)
+
+    @property
+    def enabled(self):
+        return bool(self.exporters)
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def phase(self, name):
+        """Returns a context manager that times the enclosed block as `name`."""
+        if not self.exporters:
+            return NULL_PHASE
+        return _Phase(self, name)
+
+    def record_phase(self, name, seconds):
+        for exporter in self.exporters:
+            exporter.phase(name, seconds)
+
+    def record_request(self, method, endpoint, status, seconds):
+        """Records one HTTP attempt. `status` is None if no response was received."""
+        for exporter in self.exporters:
+            exporter.request(method, endpoint, status, seconds)
+
+    def record_action(self, name, ok):
+        for exporter in self.exporters:
+            exporter.action(name, ok)
+
+
+class MetricsRecorder:
+    """Keeps counters and timing totals in memory."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.phases = {}
+            self.statuses = Counter()
+            self.endpoints = {}
+            self.actions = Counter()
+
+    @staticmethod
+    def __add(timings, key, seconds):
+        count, total, longest = timings.get(key, (0, 0.0, 0.0))
+        timings[key] = (count + 1, total + seconds, max(longest, seconds))
+
+    def phase(self, name, seconds):
+        with self.__lock:
+            self.__add(self.phases, name, seconds)
+
+    def request(self, method, endpoint, status, seconds):
+        with self.__lock:
+            self.statuses[status] += 1
+            self.__add(self.endpoints, f"{method} {endpoint}", seconds)
+
+    def action(self, name, ok):
+        with self.__lock:
+            self.actions[(name, ok)] += 1
+
+    def snapshot(self):
+        """Returns the collected metrics as plain dictionaries."""
+
+        def summary(timings):
+            return {
+                key: {"count": count, "total": total, "max": longest}
+                for key, (count, total, longest) in timings.items()
+            }
+
+        with self.__lock:
+            return {
+                "phases": summary(self.phases),
+                "requests": summary(self.endpoints),
+                "statuses": dict(self.statuses),
+                "actions": {
+                    f"{name}:{'ok' if ok else 'failed'}": count
+                    for (name, ok), count in self.actions.items()
+                },
+            }
+
+
+class LoggingExporter:
+    """Logs every event with its fields in `extra`, for structured log handlers."""
+
+    def __init__(self, logger=logger, level=logging.DEBUG):
+        self.logger = logger
+        self.level = level
+
+    def phase(self, name, seconds):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level,
+                "phase %s took %.2f ms",
+                name,
+                seconds * 1000,
+                extra={"event": "phase", "phase": name, "seconds": seconds},
+            )
+
+    def request(self, method, endpoint, status, seconds):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level,
+                "%s %s -> %s in %.2f ms",
+                method,
+                endpoint,
+                status,
+                seconds * 1000,
+                extra={
+                    "event": "request",
+                    "method": method,
+                    "endpoint": endpoint,
+                    "status": status,
+                    "seconds": seconds,
+                },
+            )
+
+    def action(self, name, ok):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level,
+                "action %s %s",
+                name,
+                "succeeded" if ok else "failed",
+                extra={"event": "action", "action": name, "ok": ok},
+            )
+
+
+class PrometheusExporter:
+    """Exports to `prometheus_client` histograms and counters."""
+
+    def __init__(self, registry=None, namespace="threads"):
+        from prometheus_client import REGISTRY, Counter, Histogram
+
+        registry = registry or REGISTRY
+        self.phase_seconds = Histogram(
+            f"{namespace}_phase_seconds",
+            "Time spent per client phase.",
+            ["phase"],
+            registry=registry,
+        )
+        self.request_seconds = Histogram(
+            f"{namespace}_request_seconds",
+            "Duration of HTTP attempts.",
+            ["method", "endpoint"],
+            registry=registry,
+        )
+        self.requests = Counter(
+            f"{namespace}_requests_total",
+            "HTTP attempts by status.",
+            ["method", "endpoint", "status"],
+            registry=registry,
+        )
+        self.actions = Counter(
+            f"{namespace}_actions_total",
+            "GraphQL mutations by outcome.",
+            ["action", "outcome"],
+            registry=registry,
+        )
+
+    def phase(self, name, seconds):
+        self.phase_seconds.labels(name).observe(seconds)
+
+    def request(self, method, endpoint, status, seconds):
+        self.request_seconds.labels(method, endpoint).observe(seconds)
+        self.requests.labels(method, endpoint, str(status or "error")).inc()
+
+    def action(self, name, ok):
+        self.actions.labels(name, "ok" if ok else "failed").inc()
+
+
+class OpenTelemetryExporter:
+    """Exports to OpenTelemetry histograms and counters."""
+
+    def __init__(self, meter=None):
+        if meter is None:
+            from opentelemetry import metrics
+
+            meter = metrics.get_meter("threads")
+        self.phase_seconds = meter.create_histogram("threads.phase.duration", unit="s")
+        self.request_seconds = meter.create_histogram("threads.http.duration", unit="s")
+        self.requests = meter.create_counter("threads.http.requests")
+        self.actions = meter.create_counter("threads.actions")
+
+    def phase(self, name, seconds):
+        self.phase_seconds.record(seconds, {"phase": name})
+
+    def request(self, method, endpoint, status, seconds):
+        attributes = {"method": method, "endpoint": endpoint}
+        self.request_seconds.record(seconds, attributes)
+        self.requests.add(1, {**attributes, "status": str(status or "error")})
+
+    def action(self, name, ok):
+        self.actions.add(1, {"action": name, "ok": ok})
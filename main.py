@@ -1,19 +1,26 @@
-from faker import Faker
+import hashlib
 import json
-from PIL import Image
-from bs4 import BeautifulSoup
+import re
 import requests
 import time
 import os
 import pickle
 from dotenv import load_dotenv
-import secrets
-from cryptography.fernet import Fernet
-import base64
 import mimetypes
-from random import randint
-from moviepy.editor import VideoFileClip
+import random
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from functools import wraps
+from contextlib import contextmanager
+import shortcode
+from instrumentation import Instrumentation, logger
+from probe import probe_dimensions
+import threading
+import weakref
+import atexit
+from concurrent.futures import FIRST_EXCEPTION, Future, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+from http.cookiejar import Cookie
 
 load_dotenv()
 
@@ -31,6 +38,9 @@ class Constants:
     CREATE_TEXT_ONLY_THREAD_ENDPOINT = "/api/v1/media/configure_text_only_post/"
     GRAPHQL_ENDPOINT = "/api/graphql"
 
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    UPLOAD_RETRIES = 3
+
     LOGIN_X_ASB_ID = "129477"
     LOGIN_X_IG_APP_ID = "238260118697367"
 
@@ -75,52 +85,2465 @@ class Constants:
     }
 
 
+class SessionCodec:
+    """Serializes the session cookies to a compact, versioned and encrypted format.
+
+    Only the fields needed to replay a cookie are kept, as JSON:
+    `{"v": 1, "cookies": [[name, value, domain, path, expires, secure], ...]}`.
+    The JSON is encrypted with Fernet using `FERNET_KEY`. A key is required
+    unless plain text is explicitly allowed, and sessions that are not
+    encrypted are rejected whenever a key is set.
+    """
+
+    VERSION = 1
+
+    def __init__(self, key=None, allow_plaintext=False):
+        """Initializes a new session codec.
+
+        Args:
+        key (str): Fernet key. Defaults to the `FERNET_KEY` environment variable.
+        allow_plaintext (bool): Store and read the session unencrypted when no key is set.
+        """
+        self.key = key or os.getenv("FERNET_KEY")
+        self.allow_plaintext = allow_plaintext
+        self.__cipher_suite = None
+        if not self.key and not allow_plaintext:
+            raise ValueError(
+                "FERNET_KEY is required to encrypt the session, "
+                "or pass SessionCodec(allow_plaintext=True)"
+            )
+
+    def __get_cipher_suite(self):
+        if self.__cipher_suite is None and self.key:
+            from cryptography.fernet import Fernet
+
+            self.__cipher_suite = Fernet(self.key.encode())
+        return self.__cipher_suite
+
+    def dumps(self, cookies):
+        payload = json.dumps(
+            {
+                "v": self.VERSION,
+                "cookies": [
+                    [
+                        cookie.name,
+                        cookie.value,
+                        cookie.domain,
+                        cookie.path,
+                        cookie.expires,
+                        cookie.secure,
+                    ]
+                    for cookie in cookies
+                ],
+            },
+            separators=(",", ":"),
+        ).encode()
+        cipher_suite = self.__get_cipher_suite()
+        if cipher_suite is None:
+            return payload
+        return cipher_suite.encrypt(payload)
+
+    def loads(self, data):
+        """Returns the cookies stored in `data`.
+
+        Returns:
+        list: One `http.cookiejar.Cookie` per stored cookie.
+        """
+        cipher_suite = self.__get_cipher_suite()
+        if cipher_suite is not None:
+            # A plain text session could have been planted to bypass the key.
+            if data.startswith(b"{"):
+                raise ValueError("The session is not encrypted with FERNET_KEY")
+            data = cipher_suite.decrypt(data)
+        elif not data.startswith(b"{"):
+            raise ValueError("FERNET_KEY is required to read the encrypted session")
+        payload = json.loads(data)
+        if payload.get("v") != self.VERSION:
+            raise ValueError(f"Unsupported session format version: {payload.get('v')}")
+        return [
+            Cookie(
+                0,
+                name,
+                value,
+                None,
+                False,
+                domain,
+                bool(domain),
+                domain.startswith("."),
+                path,
+                True,
+                secure,
+                expires,
+                expires is None,
+                None,
+                None,
+                {},
+            )
+            for name, value, domain, path, expires, secure in payload["cookies"]
+        ]
+
+
+class FileSessionBackend:
+    """Stores a session in a local file, replaced atomically on every write."""
+
+    def __init__(self, path, legacy_pickle=False):
+        """Initializes a new file backend.
+
+        Args:
+        path (str): The file the session is stored in.
+        legacy_pickle (bool): Read a jar pickled by an older version of this library once, and rewrite it as JSON. Unpickling runs code from the file, so only enable this for files you wrote yourself.
+        """
+        self.path = path
+        self.legacy_pickle = legacy_pickle
+
+    def read(self):
+        try:
+            with open(self.path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, data):
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+class SQLiteSessionBackend:
+    """Stores sessions in a SQLite table, one row per key.
+
+    Workers on the same machine can share a database file and reuse each
+    other's sessions instead of logging in again.
+    """
+
+    def __init__(self, key, path="sessions.db"):
+        import sqlite3
+
+        self.key = key
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(key TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.__db.commit()
+
+    def read(self):
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT data FROM sessions WHERE key = ?", (self.key,)
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write(self, data):
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (self.key, data, time.time()),
+            )
+
+
+class RedisSessionBackend:
+    """Stores a session under a key of a Redis-compatible server.
+
+    Args:
+    client: Any client with `get(key)` and `set(key, value, ex=None)`, e.g. `redis.Redis`.
+    key (str): The key the session is stored under.
+    ttl (int): Expire the stored session after this many seconds.
+    """
+
+    def __init__(self, client, key, ttl=None):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+
+    def read(self):
+        return self.client.get(self.key)
+
+    def write(self, data):
+        self.client.set(self.key, data, ex=self.ttl)
+
+
+class SessionState:
+    """In-memory cookie jar for a `Threads` instance.
+
+    The jar is read from its backend once and kept in memory afterwards. A
+    fingerprint of the persisted cookies is used to tell whether anything
+    changed, and changes are written back with a debounced write. The state can
+    be shared by threads: reads of the jar hold the lock `requests` takes when
+    it stores response cookies, and writes to the backend are serialized.
+    """
+
+    def __init__(
+        self,
+        path="encrypted_cookies.pkl",
+        flush_delay=1.0,
+        instrumentation=None,
+        backend=None,
+        codec=None,
+    ):
+        """Initializes a new session state.
+
+        Args:
+        path (str): The file the cookie jar is persisted to, if no backend is given.
+        flush_delay (float): Seconds to wait before writing a changed jar. Zero writes immediately.
+        instrumentation (Instrumentation): Receives the time spent in cookie I/O as `cookie_io`.
+        backend: Where the session is stored, e.g. `SQLiteSessionBackend` or `RedisSessionBackend`. Defaults to a file at `path`.
+        codec (SessionCodec): Serializes and encrypts the cookies.
+        """
+        self.path = path
+        self.flush_delay = flush_delay
+        self.instrumentation = instrumentation or Instrumentation()
+        self.backend = backend or FileSessionBackend(path)
+        self.codec = codec or SessionCodec()
+        self.cookies = requests.cookies.RequestsCookieJar()
+        # CookieJar takes this lock when cookies are set, but not when the
+        # jar is iterated.
+        self.__jar_lock = self.cookies._cookies_lock
+        self.__loaded = False
+        self.__fingerprint = self.__fingerprint_of(self.snapshot())
+        self.__timer = None
+        self.__lock = threading.Lock()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def __fingerprint_of(cookies):
+        return frozenset(
+            (cookie.domain, cookie.path, cookie.name, cookie.value, cookie.expires)
+            for cookie in cookies
+        )
+
+    def snapshot(self):
+        """Returns a list of the cookies in the jar, safe to use while requests run."""
+        with self.__jar_lock:
+            return list(self.cookies)
+
+    @property
+    def dirty(self):
+        return self.__fingerprint_of(self.snapshot()) != self.__fingerprint
+
+    def load(self, force=False):
+        """Loads the persisted jar the first time it is called.
+
+        Args:
+        force (bool): Read the backend again, e.g. to pick up a session another worker renewed.
+
+        Returns:
+        bool: True if the jar holds any cookies.
+        """
+        with self.__lock:
+            if force or not self.__loaded:
+                self.__loaded = True
+                with self.instrumentation.phase("cookie_io"):
+                    self.__read()
+        return len(self.snapshot()) > 0
+
+    def __read(self):
+        data = self.backend.read()
+        if not data:
+            return
+        legacy = data.startswith(b"\x80")
+        if legacy and not getattr(self.backend, "legacy_pickle", False):
+            raise ValueError(
+                "The session was pickled by an older version, delete it or pass "
+                "FileSessionBackend(path, legacy_pickle=True) to migrate it"
+            )
+        cookies = pickle.loads(data) if legacy else self.codec.loads(data)
+        for cookie in cookies:
+            self.cookies.set_cookie(cookie)
+        # A legacy jar stays dirty so the next flush rewrites it in the
+        # current format.
+        self.__fingerprint = None if legacy else self.__fingerprint_of(self.snapshot())
+
+    def get(self, name, default=""):
+        with self.__jar_lock:
+            return self.cookies.get(name, default)
+
+    def mark_changed(self):
+        """Schedules a write if the jar differs from what was last persisted.
+
+        Returns:
+        bool: True if a write was scheduled or performed.
+        """
+        with self.instrumentation.phase("cookie_io"):
+            dirty = self.dirty
+        if not dirty:
+            return False
+        if self.flush_delay <= 0:
+            return self.flush()
+        with self.__lock:
+            if self.__timer is None:
+                self.__timer = threading.Timer(self.flush_delay, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+        return True
+
+    def flush(self):
+        """Writes the jar to disk now if it changed.
+
+        Returns:
+        bool: True if the file was written.
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            cookies = self.snapshot()
+            fingerprint = self.__fingerprint_of(cookies)
+            if fingerprint == self.__fingerprint:
+                return False
+            with self.instrumentation.phase("cookie_io"):
+                self.backend.write(self.codec.dumps(cookies))
+            self.__fingerprint = fingerprint
+            return True
+
+
+class TokenScanner:
+    """Incrementally searches a streamed page for GraphQL tokens.
+
+    Only a small tail of the already-seen bytes is kept between chunks, so the
+    page never has to be held in memory or parsed as a whole.
+    """
+
+    def __init__(self, patterns, overlap=4096):
+        self.patterns = patterns
+        self.overlap = overlap
+        self.found = {}
+        self.__buffer = b""
+
+    def feed(self, chunk):
+        """Scans the next chunk of the page.
+
+        Returns:
+        bool: True once every token has been found and the rest of the page can be skipped.
+        """
+        self.__buffer += chunk
+        for name, patterns in self.patterns.items():
+            if name in self.found:
+                continue
+            for pattern in patterns:
+                match = pattern.search(self.__buffer)
+                if match:
+                    self.found[name] = match.group(1).decode()
+                    break
+        self.__buffer = self.__buffer[-self.overlap :]
+        return len(self.found) == len(self.patterns)
+
+
+class TokenProvider:
+    """Caches the fb_dtsg, LSD and CSRF tokens used by GraphQL requests.
+
+    fb_dtsg and LSD are read from the threads.net homepage with a streaming scan
+    that stops as soon as both tokens have been seen. Each token is kept with an
+    expiry: tokens close to expiring are refreshed in the background and expired
+    ones are refreshed before being returned. csrftoken is a cookie and is read
+    from the session state, so it expires along with the cookie itself.
+    """
+
+    PATTERNS = {
+        "fb_dtsg": [
+            re.compile(rb'id="__eqmc"[^>]*>[^<]*?"f":"([^"]+)"'),
+            re.compile(rb'"DTSGInitialData",\[\],\{"token":"([^"]+)"'),
+        ],
+        "lsd": [re.compile(rb'"LSD",\[\],\{"token":"([^"]+)"')],
+    }
+    AUTH_ERROR_CODES = {1357001, 1357004, 1357005, 1357054}
+    SCAN_CHUNK_SIZE = 16384
+    SCAN_OVERLAP = 4096
+
+    def __init__(self, fetch_page, state, ttl=3600, refresh_margin=300):
+        """Initializes a new token provider.
+
+        Args:
+        fetch_page (callable): Returns a streamed response for the threads.net homepage.
+        state (SessionState): The session state the tokens are persisted in.
+        ttl (int): Seconds a scraped token is considered valid.
+        refresh_margin (int): Seconds before expiry at which a background refresh starts.
+        """
+        self.__fetch_page = fetch_page
+        self.__state = state
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.__tokens = {}
+        self.__lock = threading.Lock()
+        self.__refreshing = False
+        self.__refreshing_lock = threading.Lock()
+
+    def get(self, name):
+        """Returns a token, refreshing it first if it has expired.
+
+        Args:
+        name (str): One of "fb_dtsg", "lsd" or "csrftoken".
+        """
+        if name == "csrftoken":
+            return self.__state.get("csrftoken", "")
+        value, expires_at = self.__lookup(name)
+        now = time.time()
+        if now >= expires_at:
+            self.refresh(force=False)
+            value, _ = self.__lookup(name)
+        elif now >= expires_at - self.refresh_margin:
+            self.refresh_in_background()
+        return value
+
+    def peek(self, name):
+        """Returns a cached token without refreshing it."""
+        return self.__lookup(name)[0]
+
+    def expires_at(self, name):
+        return self.__lookup(name)[1]
+
+    def invalidate(self):
+        for name in self.PATTERNS:
+            self.__tokens[name] = (None, 0)
+
+    def scanner(self):
+        return TokenScanner(self.PATTERNS, self.SCAN_OVERLAP)
+
+    def store(self, tokens):
+        """Caches freshly scraped tokens and persists them in the session state.
+
+        Tokens missing from `tokens` are cached as None until the next refresh.
+        """
+        expires_at = int(time.time() + self.ttl)
+        for name in self.PATTERNS:
+            value = tokens.get(name)
+            self.__tokens[name] = (value, expires_at)
+            if value:
+                self.__state.cookies.set(name, value, expires=expires_at)
+        self.__state.mark_changed()
+
+    def needs_refresh(self, rejected=None):
+        """Checks whether fb_dtsg has to be fetched again.
+
+        Args:
+        rejected (str): The fb_dtsg a request was rejected with. A different,
+            unexpired token means another caller already refreshed it.
+        """
+        value, expires_at = self.__lookup("fb_dtsg")
+        return not value or value == rejected or time.time() >= expires_at
+
+    def refresh(self, force=True, rejected=None):
+        """Fetches the tokens from the homepage.
+
+        Args:
+        force (bool): Fetch even if another caller refreshed fb_dtsg in the meantime.
+        rejected (str): The fb_dtsg a request was rejected with, see `needs_refresh`.
+
+        Returns:
+        bool: True if a valid fb_dtsg is available afterwards.
+        """
+        with self.__lock:
+            if not force and not self.needs_refresh(rejected):
+                return True
+            try:
+                tokens = self.__scan(self.__fetch_page())
+            except Exception as e:
+                logger.warning(
+                    "Failed to refresh tokens: %s", e, extra={"event": "token_refresh"}
+                )
+                return False
+            self.store(tokens)
+            return "fb_dtsg" in tokens
+
+    def refresh_in_background(self):
+        with self.__refreshing_lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self.__refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def is_auth_error(self, response):
+        """Checks whether a GraphQL response was rejected because of stale tokens."""
+        try:
+            text = response.text
+            if text.startswith("for (;;);"):
+                text = text[len("for (;;);") :]
+            payload = json.loads(text)
+        except ValueError:
+            return False
+        if not isinstance(payload, dict):
+            return False
+        if payload.get("error") in self.AUTH_ERROR_CODES:
+            return True
+        for error in payload.get("errors") or []:
+            if isinstance(error, dict) and error.get("code") in self.AUTH_ERROR_CODES:
+                return True
+        return False
+
+    def __lookup(self, name):
+        if name not in self.__tokens:
+            for cookie in self.__state.snapshot():
+                if cookie.name == name and cookie.expires:
+                    self.__tokens[name] = (cookie.value, cookie.expires)
+                    break
+            else:
+                return None, 0
+        return self.__tokens[name]
+
+    def __scan(self, response):
+        scanner = self.scanner()
+        try:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=self.SCAN_CHUNK_SIZE):
+                if scanner.feed(chunk):
+                    break
+        finally:
+            response.close()
+        return scanner.found
+
+
+class UploadIdGenerator:
+    """Snowflake-style generator of upload ids.
+
+    Each id is a 63-bit integer made of the milliseconds since `EPOCH_MS`
+    (41 bits, enough until 2093), a worker id (10 bits) and a sequence number (12 bits), so ids are unique
+    across threads and coroutines of a process and, as long as workers have
+    distinct worker ids, across processes and machines. The default worker id
+    is distinct for processes of one host whose ids differ by less than 1024;
+    set `THREADS_WORKER_ID` to guarantee uniqueness across hosts. Ids never
+    decrease: when the clock goes backwards or 4096 ids are taken in one
+    millisecond, the generator moves on to the next millisecond instead of
+    waiting.
+    """
+
+    # 2024-01-01T00:00:00Z. Counting from the Unix epoch would overflow 63 bits
+    # in 2039.
+    EPOCH_MS = 1704067200000
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+    def __init__(self, worker_id=None):
+        """Initializes a new upload id generator.
+
+        Args:
+        worker_id (int): 0-1023, unique per process. Defaults to `THREADS_WORKER_ID`, or the process id offset by a hash of the host name.
+        """
+        if worker_id is not None and not 0 <= worker_id <= self.MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {self.MAX_WORKER_ID}")
+        self.__fixed_worker_id = worker_id
+        self.__reset()
+        if hasattr(os, "register_at_fork"):
+            # A forked child must not continue the parent's sequence, nor keep
+            # a worker id derived from the parent's process id.
+            reset = weakref.WeakMethod(self.__reset)
+            os.register_at_fork(after_in_child=lambda: reset() and reset()())
+
+    def __reset(self):
+        self.__lock = threading.Lock()
+        self.worker_id = self.__fixed_worker_id
+        if self.worker_id is None:
+            self.worker_id = self.default_worker_id()
+        self.__last_ms = 0
+        self.__sequence = 0
+
+    @classmethod
+    def default_worker_id(cls):
+        env = os.getenv("THREADS_WORKER_ID")
+        if env:
+            return int(env) & cls.MAX_WORKER_ID
+        import socket
+        import zlib
+
+        # Hashing the process id as well would let two processes of one host
+        # collide. Offsetting it keeps concurrent processes, whose ids are
+        # usually close, apart, while hosts still start at different offsets.
+        offset = zlib.crc32(socket.gethostname().encode())
+        return (offset + os.getpid()) & cls.MAX_WORKER_ID
+
+    def next(self):
+        with self.__lock:
+            now = int(time.time() * 1000) - self.EPOCH_MS
+            if now > self.__last_ms:
+                self.__last_ms = now
+                self.__sequence = 0
+            elif self.__sequence < self.MAX_SEQUENCE:
+                self.__sequence += 1
+            else:
+                self.__last_ms += 1
+                self.__sequence = 0
+            return (
+                (self.__last_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self.__sequence
+            )
+
+    @classmethod
+    def parse(cls, upload_id):
+        """Splits an upload id into its Unix time in milliseconds, worker id and sequence."""
+        upload_id = int(upload_id)
+        return (
+            (upload_id >> (cls.WORKER_BITS + cls.SEQUENCE_BITS)) + cls.EPOCH_MS,
+            (upload_id >> cls.SEQUENCE_BITS) & cls.MAX_WORKER_ID,
+            upload_id & cls.MAX_SEQUENCE,
+        )
+
+
+upload_ids = UploadIdGenerator()
+
+
+def new_upload_id():
+    """Returns a new upload id from the module-wide `upload_ids` generator."""
+    return upload_ids.next()
+
+
+def get_media_dimensions(file_path):
+    """Returns the (width, height) of an image or video, or 500x500 if it cannot be read.
+
+    Dimensions are read from the file headers when possible. PIL and moviepy are
+    only used for formats the header probe does not understand.
+    """
+    dimensions = probe_dimensions(file_path)
+    if dimensions:
+        return dimensions
+    try:
+        mime_type, _ = mimetypes.guess_type(file_path)
+        if mime_type.startswith("image"):
+            from PIL import Image
+
+            with Image.open(file_path) as img:
+                return img.size
+        elif mime_type.startswith("video"):
+            from moviepy.editor import VideoFileClip
+
+            with VideoFileClip(file_path) as video:
+                return video.size
+        else:
+            raise ValueError("Unsupported media type.")
+    except Exception as e:
+        logger.warning("Could not read the dimensions of %s: %s", file_path, e)
+        return 500, 500
+
+
+def build_upload_request(
+    media_path,
+    mime_type,
+    upload_id,
+    width,
+    height,
+    is_sidecar,
+    extract_cover_frame=True,
+):
+    """Builds the rupload URL and headers for a photo or video upload.
+
+    A video uploaded with `extract_cover_frame=False` needs its cover uploaded
+    as a photo under the same upload id.
+
+    Returns:
+    tuple: The upload URL and the headers to send with it.
+    """
+    media_type = "photo" if mime_type.startswith("image") else "video"
+    X_INSTAGRAM_RUPLOAD_PARAMS = {
+        "is_sidecar": "1" if is_sidecar else "0",
+        "is_threads": "1",
+        "media_type": 1 if media_type == "photo" else 2,
+        # The web client sends the id as a string, a JSON number above 2**53
+        # may lose precision when parsed.
+        "upload_id": str(upload_id),
+        "upload_media_height": height,
+        "upload_media_width": width,
+    }
+    if media_type == "video" and extract_cover_frame:
+        X_INSTAGRAM_RUPLOAD_PARAMS["extract_cover_frame"] = "1"
+
+    headers = {
+        "accept": "*/*",
+        "accept-language": "en-US,en;q=0.9",
+        "cache-control": "no-cache",
+        "content-type": mime_type,
+        "dpr": "1",
+        "offset": "0",
+        "pragma": "no-cache",
+        "sec-ch-prefers-color-scheme": "dark",
+        "sec-ch-ua": '"Google Chrome";v="117", "Not;A=Brand";v="8", "Chromium";v="117"',
+        "sec-ch-ua-full-version-list": '"Google Chrome";v="117.0.5938.149", "Not;A=Brand";v="8.0.0.0", "Chromium";v="117.0.5938.149"',
+        "sec-ch-ua-mobile": "?0",
+        "sec-ch-ua-model": '""',
+        "sec-ch-ua-platform": '"Windows"',
+        "sec-ch-ua-platform-version": '"15.0.0"',
+        "sec-fetch-dest": "empty",
+        "sec-fetch-mode": "cors",
+        "sec-fetch-site": "same-origin",
+        "viewport-width": "1280",
+        "x-entity-length": str(os.path.getsize(media_path)),
+        "x-entity-name": f"fb_uploader_{upload_id}",
+        "x-entity-type": mime_type,
+        "x-instagram-rupload-params": json.dumps(X_INSTAGRAM_RUPLOAD_PARAMS),
+        "Referer": "https://www.threads.net/@topacipolta._gnarly_",
+        "Referrer-Policy": "origin-when-cross-origin",
+    }
+
+    URL = f"https://www.threads.net/rupload_ig{media_type}/fb_uploader_{upload_id}"
+    return URL, {**Constants.BASIC_HEADERS, **headers}
+
+
+def create_session(pool_size=10):
+    """Creates the `requests.Session` used by `Threads`.
+
+    Args:
+    pool_size (int): Maximum number of pooled connections per host, e.g. the number of threads sharing the client.
+    """
+    session = requests.Session()
+    session.mount(
+        "https://",
+        requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size),
+    )
+    # requests reads proxy, CA bundle and netrc settings from the environment
+    # on every request, which costs more CPU than the rest of a request. The
+    # hosts are fixed, so they are resolved once per host, which keeps NO_PROXY
+    # and per-host netrc entries working.
+    netrc_auth = {}
+    for url in (Constants.BASE_URL, "https://www.instagram.com"):
+        proxy = requests.utils.select_proxy(
+            url, requests.utils.get_environ_proxies(url)
+        )
+        if proxy:
+            # requests looks proxies up by "scheme://host" before "scheme".
+            session.proxies[url] = proxy
+        credentials = requests.utils.get_netrc_auth(url)
+        if credentials:
+            netrc_auth[urlsplit(url).hostname] = requests.auth.HTTPBasicAuth(
+                *credentials
+            )
+    if netrc_auth:
+
+        def auth(request):
+            host_auth = netrc_auth.get(urlsplit(request.url).hostname)
+            return host_auth(request) if host_auth else request
+
+        session.auth = auth
+    session.verify = (
+        os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE") or True
+    )
+    session.trust_env = False
+    return session
+
+
+class UserIdResolver:
+    """Resolves usernames to user ids through an LRU cache.
+
+    Answers, including "user not found", are kept for `ttl` and `negative_ttl`
+    seconds respectively. With `db_path` they are also stored in a SQLite
+    database so they survive restarts. Concurrent lookups of the same username
+    share a single search request. A resolver can be shared by several clients.
+    """
+
+    def __init__(
+        self, max_size=10000, ttl=7 * 24 * 3600, negative_ttl=3600, db_path=None
+    ):
+        """Initializes a new resolver.
+
+        Args:
+        max_size (int): Maximum number of usernames kept in memory.
+        ttl (int): Seconds a resolved user id is kept.
+        negative_ttl (int): Seconds a "not found" answer is kept.
+        db_path (str): Optional SQLite database used as a persistent backing store.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.__cache = OrderedDict()
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__db = None
+        if db_path:
+            import sqlite3
+
+            self.__db = sqlite3.connect(db_path, check_same_thread=False)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS user_ids "
+                "(username TEXT PRIMARY KEY, user_id TEXT, expires_at REAL NOT NULL)"
+            )
+            self.__db.commit()
+
+    def __remember(self, key, user_id, expires_at):
+        self.__cache[key] = (user_id, expires_at)
+        self.__cache.move_to_end(key)
+        while len(self.__cache) > self.max_size:
+            self.__cache.popitem(last=False)
+
+    def lookup(self, username):
+        """Looks a username up in the cache only.
+
+        Returns:
+        tuple: (True, user_id) for a cached answer, where user_id is None for unknown users, or (False, None).
+        """
+        key = username.lower()
+        now = time.time()
+        with self.__lock:
+            entry = self.__cache.get(key)
+            if entry and entry[1] > now:
+                self.__cache.move_to_end(key)
+                return True, entry[0]
+            if self.__db:
+                row = self.__db.execute(
+                    "SELECT user_id, expires_at FROM user_ids WHERE username = ?",
+                    (key,),
+                ).fetchone()
+                if row and row[1] > now:
+                    self.__remember(key, row[0], row[1])
+                    return True, row[0]
+        return False, None
+
+    def store(self, username, user_id):
+        """Caches the answer for a username and returns the user id as stored."""
+        key = username.lower()
+        if user_id is not None:
+            user_id = str(user_id)
+        expires_at = time.time() + (
+            self.ttl if user_id is not None else self.negative_ttl
+        )
+        with self.__lock:
+            self.__remember(key, user_id, expires_at)
+            if self.__db:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO user_ids VALUES (?, ?, ?)",
+                    (key, user_id, expires_at),
+                )
+                self.__db.commit()
+        return user_id
+
+    def invalidate(self, username=None):
+        """Forgets one username, or every username if none is given."""
+        with self.__lock:
+            if username is None:
+                self.__cache.clear()
+                if self.__db:
+                    self.__db.execute("DELETE FROM user_ids")
+            else:
+                self.__cache.pop(username.lower(), None)
+                if self.__db:
+                    self.__db.execute(
+                        "DELETE FROM user_ids WHERE username = ?", (username.lower(),)
+                    )
+            if self.__db:
+                self.__db.commit()
+
+    def resolve(self, username, search):
+        """Returns the user id of a username, searching for it on a cache miss.
+
+        Args:
+        username (str): The username to resolve.
+        search (callable): Looks a username up on the server and returns its user id or None.
+        """
+        found, user_id = self.lookup(username)
+        if found:
+            return user_id
+        key = username.lower()
+        with self.__lock:
+            future = self.__pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.__pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            user_id = self.store(username, search(username))
+            future.set_result(user_id)
+            return user_id
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    def resolve_many(self, usernames, search, max_workers=8):
+        """Resolves many usernames, searching for the uncached ones concurrently.
+
+        Returns:
+        dict: The user id (or None) of each distinct username.
+        """
+        usernames = list(dict.fromkeys(usernames))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            user_ids = pool.map(
+                lambda username: self.resolve(username, search), usernames
+            )
+            return dict(zip(usernames, user_ids))
+
+
+class MediaCache:
+    """Content-addressed cache of media fingerprints, dimensions and upload ids.
+
+    Files are identified by a BLAKE2b digest of their content. The digest of a
+    path is reused while its size and modification time are unchanged, so a
+    known file is neither hashed nor probed again. Upload ids are kept per
+    scope, i.e. per account and upload kind, for `upload_ttl` seconds, so the
+    same content is not uploaded twice while the server still knows it.
+    Entries are evicted least recently used first beyond `max_size`, and when
+    they expire. With `db_path` they are also stored in a SQLite database. A
+    cache can be shared by several clients.
+    """
+
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(
+        self, max_size=1024, ttl=30 * 24 * 3600, upload_ttl=3600, db_path=None
+    ):
+        """Initializes a new media cache.
+
+        Args:
+        max_size (int): Maximum number of entries of each kind kept in memory.
+        ttl (int): Seconds a file digest and the dimensions of a content are kept.
+        upload_ttl (int): Seconds an upload id is reused.
+        db_path (str): Optional SQLite database used as a persistent backing store.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.upload_ttl = upload_ttl
+        self.__files = OrderedDict()
+        self.__dimensions = OrderedDict()
+        self.__uploads = OrderedDict()
+        self.__pending = {}
+        self.__lock = threading.Lock()
+        self.__db = None
+        if db_path:
+            import sqlite3
+
+            self.__db = sqlite3.connect(db_path, check_same_thread=False)
+            self.__db.executescript("""
+                CREATE TABLE IF NOT EXISTS media_files (
+                    key TEXT PRIMARY KEY, digest TEXT, expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS media_dimensions (
+                    key TEXT PRIMARY KEY, width INTEGER, height INTEGER,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS media_uploads (
+                    key TEXT PRIMARY KEY, upload_id TEXT, expires_at REAL NOT NULL
+                );
+                """)
+            self.__db.commit()
+
+    def __get(self, table, cache, key):
+        now = time.time()
+        with self.__lock:
+            entry = cache.get(key)
+            if entry and entry[1] > now:
+                cache.move_to_end(key)
+                return entry[0]
+            cache.pop(key, None)
+            if self.__db:
+                row = self.__db.execute(
+                    f"SELECT * FROM {table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[-1] > now:
+                    value = row[1] if len(row) == 3 else (row[1], row[2])
+                    self.__remember(cache, key, value, row[-1])
+                    return value
+        return None
+
+    def __set(self, table, cache, key, value, ttl):
+        expires_at = time.time() + ttl
+        with self.__lock:
+            self.__remember(cache, key, value, expires_at)
+            if self.__db:
+                row = value if isinstance(value, tuple) else (value,)
+                self.__db.execute(
+                    f"INSERT OR REPLACE INTO {table} VALUES "
+                    f"(?, {', '.join('?' * len(row))}, ?)",
+                    (key, *row, expires_at),
+                )
+                self.__db.execute(
+                    f"DELETE FROM {table} WHERE expires_at < ?", (time.time(),)
+                )
+                self.__db.commit()
+
+    def __remember(self, cache, key, value, expires_at):
+        cache[key] = (value, expires_at)
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+    def fingerprint(self, path):
+        """Returns the BLAKE2b digest of a file, hashing it only if it changed."""
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = self.__get("media_files", self.__files, key)
+        if digest is None:
+            hasher = hashlib.blake2b(digest_size=20)
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(self.HASH_CHUNK_SIZE), b""):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            self.__set("media_files", self.__files, key, digest, self.ttl)
+        return digest
+
+    def dimensions(self, digest, probe):
+        """Returns the (width, height) of a content, calling `probe()` on a miss."""
+        dimensions = self.__get("media_dimensions", self.__dimensions, digest)
+        if dimensions is None:
+            dimensions = tuple(probe())
+            self.__set(
+                "media_dimensions", self.__dimensions, digest, dimensions, self.ttl
+            )
+        return dimensions
+
+    def lookup_upload(self, scope, digest):
+        """Returns the cached upload id of a content in a scope, or None."""
+        return self.__get("media_uploads", self.__uploads, f"{scope}:{digest}")
+
+    def store_upload(self, scope, digest, upload_id):
+        self.__set(
+            "media_uploads",
+            self.__uploads,
+            f"{scope}:{digest}",
+            str(upload_id),
+            self.upload_ttl,
+        )
+
+    def upload(self, scope, digest, upload, reused=None):
+        """Returns the upload id of a content, calling `upload()` on a miss.
+
+        Concurrent uploads of the same content in the same scope share one call.
+
+        Args:
+        reused (set): Collects the upload ids that were served from the cache.
+        """
+        upload_id = self.lookup_upload(scope, digest)
+        if upload_id is not None:
+            if reused is not None:
+                reused.add(upload_id)
+            return upload_id
+        key = f"{scope}:{digest}"
+        with self.__lock:
+            future = self.__pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.__pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            upload_id = upload()
+            self.store_upload(scope, digest, upload_id)
+            future.set_result(upload_id)
+            return upload_id
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                self.__pending.pop(key, None)
+
+    def forget_uploads(self, upload_ids):
+        """Drops cached upload ids, e.g. after the server rejected them.
+
+        Returns:
+        bool: Whether any of the upload ids was cached.
+        """
+        upload_ids = {str(upload_id) for upload_id in upload_ids}
+        with self.__lock:
+            keys = [
+                key
+                for key, (upload_id, _) in self.__uploads.items()
+                if upload_id in upload_ids
+            ]
+            for key in keys:
+                del self.__uploads[key]
+            if self.__db:
+                cursor = self.__db.executemany(
+                    "DELETE FROM media_uploads WHERE upload_id = ?",
+                    [(upload_id,) for upload_id in upload_ids],
+                )
+                self.__db.commit()
+                return bool(keys) or cursor.rowcount > 0
+        return bool(keys)
+
+    def invalidate(self):
+        """Forgets every entry."""
+        with self.__lock:
+            self.__files.clear()
+            self.__dimensions.clear()
+            self.__uploads.clear()
+            if self.__db:
+                self.__db.executescript("""
+                    DELETE FROM media_files;
+                    DELETE FROM media_dimensions;
+                    DELETE FROM media_uploads;
+                    """)
+
+
+class RequestTemplates:
+    """Prebuilt GraphQL mutation requests, keyed by `Constants.DOC_IDS` name.
+
+    Headers and static form fields are built once per session. Preparing a
+    request only fills in the variables and the current tokens, and the headers
+    are rebuilt only when the CSRF or LSD token changes.
+    """
+
+    # doc name: (variables key, extra variables, x-fb-friendly-name)
+    SPECS = {
+        "LIKE": ("media_id", {}, "useBarcelonaLikeMutationLikeMutation"),
+        "UNLIKE": ("media_id", {}, "useBarcelonaLikeMutationLikeMutation"),
+        "DELETE": ("media_id", {}, None),
+        "REPOST": ("media_id", {"repost_context": None}, None),
+        "UNREPOST": ("media_id", {"repost_context": None}, None),
+        "FOLLOW": ("target_user_id", {}, None),
+        "UNFOLLOW": ("target_user_id", {}, None),
+        "BLOCK": ("user_id", {}, None),
+        "UNBLOCK": ("user_id", {}, None),
+        "MUTE": ("author_id", {}, None),
+        "UNMUTE": ("author_id", {}, None),
+        # Requests whose variables are passed as a whole to `prepare_query`.
+        "GET_NOTIFICATION": (None, {}, None),
+        "MARK_NOTIFICATIONS_READ": (None, {}, None),
+    }
+    DEFAULT_LSD = "kUS5ScWK1mWaeRscjA50tY"
+    SERVER_TIMESTAMPS = ["true"]
+
+    def __init__(self):
+        base_headers = {
+            **{
+                name: value
+                for name, value in Constants.BASIC_HEADERS.items()
+                if name.lower() != "x-fb-lsd"
+            },
+            "x-asbd-id": "129477",
+            "x-ig-app-id": "238260118697367",
+            "x-instagram-ajax": "0",
+            "Referer": "https://www.threads.net/",
+            "Referrer-Policy": "origin-when-cross-origin",
+        }
+        self.__templates = {}
+        for doc_name, (key, extra, friendly_name) in self.SPECS.items():
+            prefix = "{" + json.dumps(key) + ":"
+            suffix = "".join(
+                f",{json.dumps(name)}:{json.dumps(value)}"
+                for name, value in extra.items()
+            )
+            headers = dict(base_headers)
+            if friendly_name:
+                headers["x-fb-friendly-name"] = friendly_name
+            self.__templates[doc_name] = (
+                prefix,
+                suffix + "}",
+                headers,
+                [Constants.DOC_IDS[doc_name]],
+            )
+        self.__headers = {}
+
+    def doc_id(self, doc_name):
+        return self.__templates[doc_name][3][0]
+
+    def check_distinct(self, doc_name, other):
+        """Raises ValueError if two requests were configured with the same doc id."""
+        if self.doc_id(doc_name) == self.doc_id(other):
+            raise ValueError(
+                f'Constants.DOC_IDS["{doc_name}"] is the doc id of {other}, '
+                "set the right doc id before creating the client"
+            )
+
+    def variables(self, doc_name, target):
+        prefix, suffix, _, _ = self.__templates[doc_name]
+        return prefix + json.dumps(str(target)) + suffix
+
+    def headers(self, doc_name, csrftoken, lsd=None):
+        """Returns the headers for a mutation. The returned dict must not be modified."""
+        cached = self.__headers.get(doc_name)
+        if cached and cached[0] == csrftoken and cached[1] == lsd:
+            return cached[2]
+        headers = {
+            **self.__templates[doc_name][2],
+            "x-csrftoken": csrftoken,
+            "x-fb-lsd": lsd or self.DEFAULT_LSD,
+        }
+        self.__headers[doc_name] = (csrftoken, lsd, headers)
+        return headers
+
+    def prepare(self, doc_name, target, fb_dtsg, csrftoken, lsd=None):
+        """Builds a GraphQL mutation request.
+
+        Args:
+        doc_name (str): A key of `Constants.DOC_IDS`, e.g. "LIKE".
+        target (str): The media or user id the mutation applies to.
+        fb_dtsg (str): The current fb_dtsg token.
+        csrftoken (str): The current CSRF token.
+        lsd (str): The current LSD token, if known.
+
+        Returns:
+        tuple: The headers and form data of the request.
+        """
+        data = {
+            "fb_dtsg": [fb_dtsg],
+            "variables": self.variables(doc_name, target),
+            "server_timestamps": self.SERVER_TIMESTAMPS,
+            "doc_id": self.__templates[doc_name][3],
+        }
+        return self.headers(doc_name, csrftoken, lsd), data
+
+    def prepare_query(self, doc_name, variables, fb_dtsg, csrftoken, lsd=None):
+        """Builds a GraphQL request from a full variables dict.
+
+        Returns:
+        tuple: The headers and form data of the request.
+        """
+        data = {
+            "fb_dtsg": [fb_dtsg],
+            "variables": json.dumps(variables),
+            "server_timestamps": self.SERVER_TIMESTAMPS,
+            "doc_id": self.__templates[doc_name][3],
+        }
+        return self.headers(doc_name, csrftoken, lsd), data
+
+
+def find_connection(payload):
+    """Finds the first paginated connection in a GraphQL response.
+
+    Returns:
+    tuple: The nodes of the page, the cursor of its last item and whether more pages follow.
+    """
+    pending = [payload]
+    while pending:
+        value = pending.pop(0)
+        if isinstance(value, list):
+            pending.extend(value)
+        elif isinstance(value, dict):
+            if isinstance(value.get("edges"), list):
+                page_info = value.get("page_info") or value.get("pageInfo") or {}
+                nodes = [edge.get("node", edge) for edge in value["edges"]]
+                end_cursor = page_info.get("end_cursor") or page_info.get("endCursor")
+                has_next_page = page_info.get(
+                    "has_next_page", page_info.get("hasNextPage", False)
+                )
+                return nodes, end_cursor, bool(has_next_page)
+            pending.extend(value.values())
+    return [], None, False
+
+
+class WatermarkStore:
+    """SQLite store of per-account sync high-water marks.
+
+    For each account it keeps the cursor of an unfinished backlog, the newest
+    item timestamp, the timestamp that becomes the watermark once the backlog
+    is drained, and the ids of the newest items seen, trimmed to `max_seen`
+    per account by item timestamp.
+    """
+
+    def __init__(self, path="sync_state.db", max_seen=1000):
+        import sqlite3
+
+        self.max_seen = max_seen
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS watermarks (
+                account TEXT PRIMARY KEY, cursor TEXT, timestamp REAL
+            );
+            CREATE TABLE IF NOT EXISTS seen_ids (
+                account TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (account, item_id)
+            ) WITHOUT ROWID;
+            """)
+        # Columns added after the first release of this store.
+        for table, column in (("watermarks", "pending"), ("seen_ids", "timestamp")):
+            columns = {
+                row[1] for row in self.__db.execute(f"PRAGMA table_info({table})")
+            }
+            if column not in columns:
+                self.__db.execute(f"ALTER TABLE {table} ADD COLUMN {column} REAL")
+        self.__db.commit()
+
+    def load(self, account):
+        """Returns the cursor, timestamp, pending timestamp and set of seen ids of an account."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT cursor, timestamp, pending FROM watermarks WHERE account = ?",
+                (account,),
+            ).fetchone()
+            seen_ids = {
+                item_id
+                for (item_id,) in self.__db.execute(
+                    "SELECT item_id FROM seen_ids WHERE account = ?", (account,)
+                )
+            }
+        cursor, timestamp, pending = row or (None, None, None)
+        return cursor, timestamp, pending, seen_ids
+
+    def save(self, account, cursor, timestamp, new_ids, pending=None):
+        """Stores a new watermark and adds `new_ids` to the seen ids of an account.
+
+        Args:
+        new_ids (list): (item id, item timestamp or None) pairs.
+        pending (float): The timestamp to make the watermark once `cursor` is drained.
+        """
+        now = time.time()
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT OR REPLACE INTO watermarks "
+                "(account, cursor, timestamp, pending) VALUES (?, ?, ?, ?)",
+                (account, cursor, timestamp, pending),
+            )
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO seen_ids "
+                "(account, item_id, seen_at, timestamp) VALUES (?, ?, ?, ?)",
+                [(account, item_id, now, ts) for item_id, ts in new_ids],
+            )
+            # Ordered by item timestamp, so backfilling old items does not
+            # push out the newest ones the next poll stops at.
+            self.__db.execute(
+                "DELETE FROM seen_ids WHERE account = ? AND item_id NOT IN "
+                "(SELECT item_id FROM seen_ids WHERE account = ? "
+                "ORDER BY COALESCE(timestamp, seen_at) DESC LIMIT ?)",
+                (account, account, self.max_seen),
+            )
+
+
+class IncrementalSync:
+    """Polls a newest-first paginated feed and returns only items not seen before.
+
+    Pagination stops at the first page that reaches known data, i.e. an item
+    whose id was already seen or that is older than the stored timestamp.
+
+    Example:
+    sync = IncrementalSync(threads.iter_notification_pages, WatermarkStore(), "my_account")
+    new_notifications = sync.poll()
+    """
+
+    ID_FIELDS = ("id", "pk", "notif_id")
+    TIMESTAMP_FIELDS = ("timestamp", "created_at", "time")
+
+    def __init__(self, iter_pages, store, account, page_size=20, max_pages=10):
+        """Initializes a new incremental sync.
+
+        Args:
+        iter_pages (callable): Yields (items, cursor) pages newest first, e.g. `Threads.iter_notification_pages`.
+        store (WatermarkStore): Where the high-water marks are kept.
+        account (str): The key the watermarks are stored under.
+        page_size (int): Number of items requested per page.
+        max_pages (int): Maximum number of pages fetched per poll.
+        """
+        self.iter_pages = iter_pages
+        self.store = store
+        self.account = account
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+    def item_id(self, item):
+        for field in self.ID_FIELDS:
+            if item.get(field) is not None:
+                return str(item[field])
+        return json.dumps(item, sort_keys=True)
+
+    def item_timestamp(self, item):
+        for field in self.TIMESTAMP_FIELDS:
+            if isinstance(item.get(field), (int, float)):
+                return item[field]
+        return None
+
+    def poll(self):
+        """Fetches the items added since the last poll.
+
+        If `max_pages` runs out before known data is reached, the cursor of the
+        last page is stored and the next polls first resume the backlog from
+        it, so no items are skipped between polls. The newest timestamp of the
+        poll that left the backlog becomes the watermark once it is drained.
+
+        Returns:
+        list: The new items, newest first.
+        """
+        stored = self.store.load(self.account)
+        backlog, watermark, pending, seen_ids = stored
+        budget = self.max_pages
+        new_items = []
+        new_ids = []
+        if backlog:
+            # The backlog is older than the pending timestamp, only the
+            # watermark bounds it.
+            items, ids, _, pages, backlog = self.__scan(
+                backlog, budget, watermark, seen_ids
+            )
+            new_items.extend(items)
+            new_ids.extend(ids)
+            budget -= pages
+            if not backlog:
+                watermark, pending = self.__later(watermark, pending), None
+        if not backlog and budget > 0:
+            items, ids, newest, _, backlog = self.__scan(
+                None, budget, watermark, seen_ids
+            )
+            new_items[:0] = items
+            new_ids.extend(ids)
+            if backlog:
+                # Items older than the watermark are treated as known, so the
+                # head's timestamp waits until the backlog below it is drained.
+                pending = self.__later(watermark, newest)
+            else:
+                watermark = self.__later(watermark, newest)
+        if new_ids or (backlog, watermark, pending) != stored[:3]:
+            self.store.save(self.account, backlog, watermark, new_ids, pending)
+        return new_items
+
+    @staticmethod
+    def __later(a, b):
+        if a is None or b is None:
+            return a if b is None else b
+        return max(a, b)
+
+    def __scan(self, cursor, max_pages, watermark, seen_ids):
+        """Pages from `cursor` until known data is reached or `max_pages` runs out.
+
+        Returns:
+        tuple: The new items, their (id, timestamp) pairs, their newest
+        timestamp, the number of pages fetched and the cursor to resume from,
+        or None if known data or the end of the feed was reached.
+        """
+        new_items = []
+        new_ids = []
+        newest = None
+        pages = 0
+        last_cursor = None
+        for items, last_cursor in self.iter_pages(
+            cursor=cursor, page_size=self.page_size, max_pages=max_pages
+        ):
+            pages += 1
+            reached_known = False
+            for item in items:
+                item_id = self.item_id(item)
+                timestamp = self.item_timestamp(item)
+                if item_id in seen_ids or (
+                    timestamp is not None
+                    and watermark is not None
+                    and timestamp < watermark
+                ):
+                    reached_known = True
+                    continue
+                seen_ids.add(item_id)
+                new_ids.append((item_id, timestamp))
+                new_items.append(item)
+                newest = self.__later(newest, timestamp)
+            if reached_known:
+                return new_items, new_ids, newest, pages, None
+        resume = last_cursor if pages >= max_pages else None
+        return new_items, new_ids, newest, pages, resume
+
+
+class BatchResult:
+    """Outcome of a single action in a `ThreadsBatch`."""
+
+    def __init__(self, action, target, ok, response=None, error=None):
+        self.action = action
+        self.target = target
+        self.ok = ok
+        self.response = response
+        self.error = error
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return f"<BatchResult {self.action} {self.target} {status}>"
+
+
+class ThreadsBatch:
+    """Collects GraphQL mutations and sends them together.
+
+    Tokens and headers are resolved once for the whole batch, payloads are built
+    up front and sent with bounded concurrency. `execute` returns one
+    `BatchResult` per queued action, in the order the actions were added; a
+    failing action does not stop the others.
+    """
+
+    ACTIONS = {
+        "like": "LIKE",
+        "unlike": "UNLIKE",
+        "repost": "REPOST",
+        "unrepost": "UNREPOST",
+        "follow": "FOLLOW",
+        "unfollow": "UNFOLLOW",
+        "block": "BLOCK",
+        "unblock": "UNBLOCK",
+        "mute": "MUTE",
+        "unmute": "UNMUTE",
+    }
+
+    def __init__(self, run, max_workers=8):
+        """Initializes a new batch.
+
+        Args:
+        run (callable): Sends the queued items, see `Threads.batch`.
+        max_workers (int): Maximum number of requests in flight at once.
+        """
+        self.__run = run
+        self.max_workers = max_workers
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __add_post(self, action, post_id):
+        self.items.append((action, None, post_id))
+        return self
+
+    def __add_user(self, action, username, user_id):
+        if not username and not user_id:
+            raise ValueError("Either username or user_id is required")
+        self.items.append((action, username, user_id))
+        return self
+
+    def like(self, post_id):
+        return self.__add_post("like", post_id)
+
+    def unlike(self, post_id):
+        return self.__add_post("unlike", post_id)
+
+    def repost(self, thread_id):
+        return self.__add_post("repost", thread_id)
+
+    def unrepost(self, thread_id):
+        return self.__add_post("unrepost", thread_id)
+
+    def follow(self, username: str = None, user_id: str = None):
+        return self.__add_user("follow", username, user_id)
+
+    def unfollow(self, username: str = None, user_id: str = None):
+        return self.__add_user("unfollow", username, user_id)
+
+    def block(self, username: str = None, user_id: str = None):
+        return self.__add_user("block", username, user_id)
+
+    def unblock(self, username: str = None, user_id: str = None):
+        return self.__add_user("unblock", username, user_id)
+
+    def mute(self, username: str = None, user_id: str = None):
+        return self.__add_user("mute", username, user_id)
+
+    def unmute(self, username: str = None, user_id: str = None):
+        return self.__add_user("unmute", username, user_id)
+
+    def execute(self):
+        """Sends every queued action.
+
+        Returns:
+        list: A `BatchResult` per action, in the order the actions were added.
+        """
+        return self.__run(self, self.max_workers)
+
+
+class PostLedger:
+    """SQLite record of posts published by `Threads.post_many`, by idempotency key.
+
+    A key is claimed before its media is uploaded and marked done with the
+    server's response once the post is configured. Keys are released again
+    when the post definitely failed. A post whose configure request was sent
+    but got no response stays pending: it may or may not have been published,
+    so it is not sent again until the key is discarded.
+    """
+
+    PENDING = "pending"
+    DONE = "done"
+
+    def __init__(self, path=":memory:"):
+        import sqlite3
+
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.executescript("""
+            CREATE TABLE IF NOT EXISTS posts (
+                key TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                response TEXT,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID;
+            """)
+        self.__db.commit()
+
+    def get(self, key):
+        """Returns the state and stored response of a key, or (None, None)."""
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT state, response FROM posts WHERE key = ?", (key,)
+            ).fetchone()
+        if not row:
+            return None, None
+        state, response = row
+        return state, json.loads(response) if response else None
+
+    def claim(self, key):
+        """Marks a key as pending. Returns False if it was already claimed or done."""
+        with self.__lock, self.__db:
+            cursor = self.__db.execute(
+                "INSERT OR IGNORE INTO posts VALUES (?, ?, NULL, ?)",
+                (key, self.PENDING, time.time()),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, key, response):
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "UPDATE posts SET state = ?, response = ?, updated_at = ? WHERE key = ?",
+                (self.DONE, json.dumps(response), time.time(), key),
+            )
+
+    def release(self, key):
+        """Forgets a key, so that the post can be published again."""
+        with self.__lock, self.__db:
+            self.__db.execute("DELETE FROM posts WHERE key = ?", (key,))
+
+    discard = release
+
+
+class ActionJournal:
+    """Write-ahead journal of GraphQL mutations, sent in coalesced batches.
+
+    Actions are written to a SQLite database before anything is sent, and a
+    debounced flush sends them through `Threads.batch` after `flush_delay`
+    seconds. Before sending, the actions on the same target are reduced to
+    their net effect: duplicates collapse into one call, and an action
+    followed by its opposite (like and unlike, follow and unfollow, ...)
+    cancels out. Sent actions are removed from the journal. Actions left over
+    by a crashed process are sent again by the next journal opened on the same
+    database. They are claimed for `lease` seconds while being sent, so
+    several workers can share a database.
+
+    Users are matched by username or user id as given, so a follow by username
+    and an unfollow by user id of the same user do not cancel out.
+
+    Example:
+    journal = ActionJournal(threads, "actions.db")
+    journal.like(post_id)
+    journal.unlike(post_id)  # neither is sent
+    journal.follow(username="alice")
+    journal.flush()
+    """
+
+    PENDING = "pending"
+    SENDING = "sending"
+    FAILED = "failed"
+    # Each action and its opposite share a group.
+    GROUPS = {
+        "like": ("like", True),
+        "unlike": ("like", False),
+        "repost": ("repost", True),
+        "unrepost": ("repost", False),
+        "follow": ("follow", True),
+        "unfollow": ("follow", False),
+        "block": ("block", True),
+        "unblock": ("block", False),
+        "mute": ("mute", True),
+        "unmute": ("mute", False),
+    }
+
+    def __init__(
+        self,
+        client,
+        path="actions.db",
+        account=None,
+        flush_delay=1.0,
+        max_workers=8,
+        max_attempts=5,
+        lease=60,
+    ):
+        """Initializes a new journal and schedules the actions left from earlier runs.
+
+        Args:
+        client (Threads): The client the actions are sent with.
+        path (str): The SQLite database the journal is kept in.
+        account (str): The key the actions are stored under. Defaults to the client's username.
+        flush_delay (float): Seconds to collect actions before sending them. Zero sends immediately.
+        max_workers (int): Maximum number of requests in flight during a flush.
+        max_attempts (int): Flushes an action may fail in before it is marked as failed.
+        lease (float): Seconds a flush may take before other workers send its actions again.
+        """
+        import sqlite3
+
+        self.client = client
+        self.account = account or client.username or ""
+        self.flush_delay = flush_delay
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        self.__timer = None
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        # WAL keeps committed actions across process crashes without an
+        # fsync per action.
+        self.__db.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account TEXT NOT NULL,
+                action TEXT NOT NULL,
+                username TEXT,
+                target TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                claimed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS actions_by_state
+                ON actions (account, state, id);
+            """)
+        self.__db.commit()
+        atexit.register(self.flush)
+        if self.pending():
+            self.__schedule()
+
+    def __record(self, action, username=None, target=None):
+        if not username and not target:
+            raise ValueError("Either username or user_id is required")
+        with self.__lock, self.__db:
+            self.__db.execute(
+                "INSERT INTO actions (account, action, username, target, state) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.account, action, username, target, self.PENDING),
+            )
+        self.__schedule()
+        return self
+
+    def __schedule(self, delay=None):
+        if delay is None:
+            if self.flush_delay <= 0:
+                self.flush()
+                return
+            delay = self.flush_delay
+        with self.__lock:
+            if self.__timer is None:
+                self.__timer = threading.Timer(delay, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def like(self, post_id):
+        return self.__record("like", target=post_id)
+
+    def unlike(self, post_id):
+        return self.__record("unlike", target=post_id)
+
+    def repost(self, thread_id):
+        return self.__record("repost", target=thread_id)
+
+    def unrepost(self, thread_id):
+        return self.__record("unrepost", target=thread_id)
+
+    def follow(self, username: str = None, user_id: str = None):
+        return self.__record("follow", username, user_id)
+
+    def unfollow(self, username: str = None, user_id: str = None):
+        return self.__record("unfollow", username, user_id)
+
+    def block(self, username: str = None, user_id: str = None):
+        return self.__record("block", username, user_id)
+
+    def unblock(self, username: str = None, user_id: str = None):
+        return self.__record("unblock", username, user_id)
+
+    def mute(self, username: str = None, user_id: str = None):
+        return self.__record("mute", username, user_id)
+
+    def unmute(self, username: str = None, user_id: str = None):
+        return self.__record("unmute", username, user_id)
+
+    def pending(self):
+        """Returns the number of actions of this account waiting to be sent."""
+        with self.__lock:
+            (count,) = self.__db.execute(
+                "SELECT COUNT(*) FROM actions WHERE account = ? AND state != ?",
+                (self.account, self.FAILED),
+            ).fetchone()
+        return count
+
+    def failed(self):
+        """Returns the (action, username, user id or post id, error) of actions that were given up on."""
+        with self.__lock:
+            return self.__db.execute(
+                "SELECT action, username, target, error FROM actions "
+                "WHERE account = ? AND state = ? ORDER BY id",
+                (self.account, self.FAILED),
+            ).fetchall()
+
+    @classmethod
+    def coalesce(cls, entries):
+        """Reduces journal entries to the calls with the same net effect.
+
+        Args:
+        entries (list): (id, action, username, target) tuples in journal order.
+
+        Returns:
+        tuple: A list of (action, username, target, ids) calls to send, and the ids of the entries that cancelled out.
+        """
+        groups = OrderedDict()
+        for entry in entries:
+            _, action, username, target = entry
+            group, _ = cls.GROUPS[action]
+            groups.setdefault((group, username, target), []).append(entry)
+
+        calls = []
+        cancelled = []
+        for (_, username, target), group_entries in groups.items():
+            net = None
+            for _, action, _, _ in group_entries:
+                if net is None:
+                    net = action
+                elif cls.GROUPS[action][1] != cls.GROUPS[net][1]:
+                    net = None
+            ids = [entry[0] for entry in group_entries]
+            if net is None:
+                cancelled.extend(ids)
+            else:
+                calls.append((net, username, target, ids))
+        return calls, cancelled
+
+    def __claim(self):
+        now = time.time()
+        with self.__lock, self.__db:
+            entries = self.__db.execute(
+                "SELECT id, action, username, target FROM actions "
+                "WHERE account = ? AND (state = ? OR (state = ? AND claimed_at < ?)) "
+                "ORDER BY id",
+                (self.account, self.PENDING, self.SENDING, now - self.lease),
+            ).fetchall()
+            self.__db.executemany(
+                "UPDATE actions SET state = ?, claimed_at = ? WHERE id = ?",
+                [(self.SENDING, now, entry[0]) for entry in entries],
+            )
+        return entries
+
+    def __lease_remaining(self):
+        """Returns the seconds until the oldest lease of another flush expires, or None."""
+        with self.__lock:
+            (claimed_at,) = self.__db.execute(
+                "SELECT MIN(claimed_at) FROM actions WHERE account = ? AND state = ?",
+                (self.account, self.SENDING),
+            ).fetchone()
+        if claimed_at is None:
+            return None
+        return max(0.0, claimed_at + self.lease - time.time())
+
+    def flush(self):
+        """Sends the pending actions now.
+
+        Returns:
+        dict: The number of calls `sent`, `failed` and of actions `cancelled` out.
+        """
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+        summary = {"sent": 0, "failed": 0, "cancelled": 0}
+        with self.__flush_lock:
+            entries = self.__claim()
+            if not entries:
+                # Actions claimed by a worker that may have died are taken
+                # over once its lease runs out.
+                remaining = self.__lease_remaining()
+                if remaining is not None:
+                    self.__schedule(remaining)
+                return summary
+            calls, cancelled = self.coalesce(entries)
+            done = list(cancelled)
+            retry = []
+            summary["cancelled"] = len(cancelled)
+            if calls:
+                batch = self.client.batch(self.max_workers)
+                for action, username, target, _ in calls:
+                    if action in ("like", "unlike", "repost", "unrepost"):
+                        getattr(batch, action)(target)
+                    else:
+                        getattr(batch, action)(username=username, user_id=target)
+                try:
+                    results = batch.execute()
+                except Exception as e:
+                    results = [
+                        BatchResult(call[0], call[2], False, error=e) for call in calls
+                    ]
+                for (_, _, _, ids), result in zip(calls, results):
+                    if result.ok:
+                        done.extend(ids)
+                        summary["sent"] += 1
+                    else:
+                        retry.extend((str(result.error), entry_id) for entry_id in ids)
+                        summary["failed"] += 1
+            with self.__lock, self.__db:
+                self.__db.executemany(
+                    "DELETE FROM actions WHERE id = ?",
+                    [(entry_id,) for entry_id in done],
+                )
+                self.__db.executemany(
+                    "UPDATE actions SET attempts = attempts + 1, error = ?, "
+                    "state = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END, "
+                    "claimed_at = NULL WHERE id = ?",
+                    [
+                        (error, self.max_attempts, self.FAILED, self.PENDING, entry_id)
+                        for error, entry_id in retry
+                    ],
+                )
+        if summary["failed"] and self.pending():
+            self.__schedule()
+        logger.debug(
+            "Flushed the action journal",
+            extra={"event": "journal_flush", **summary},
+        )
+        return summary
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    Holds up to `capacity` tokens and regains `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(
+            self.capacity, self.__tokens + (now - self.__updated) * self.rate
+        )
+        self.__updated = now
+
+    @property
+    def available(self):
+        with self.__lock:
+            self.__refill()
+            return self.__tokens
+
+    def try_acquire(self, tokens=1):
+        """Takes tokens if they are available.
+
+        Returns:
+        float: 0 if the tokens were taken, otherwise the seconds until they will be available.
+        """
+        with self.__lock:
+            self.__refill()
+            if self.__tokens >= tokens:
+                self.__tokens -= tokens
+                return 0
+            return (tokens - self.__tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """Blocks until the tokens are available and takes them."""
+        while True:
+            wait_for = self.try_acquire(tokens)
+            if not wait_for:
+                return
+            time.sleep(wait_for)
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised when requests to an endpoint are suspended after repeated failures."""
+
+
+class CircuitBreaker:
+    """Per-endpoint circuit breaker.
+
+    After `failure_threshold` consecutive failures an endpoint is opened and
+    requests to it fail fast for `reset_timeout` seconds. After that a single
+    trial request is let through; its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__failures = {}
+        self.__opened_at = {}
+        self.__trial = set()
+        self.__lock = threading.Lock()
+
+    def allow(self, endpoint):
+        with self.__lock:
+            opened_at = self.__opened_at.get(endpoint)
+            if opened_at is None:
+                return True
+            if endpoint in self.__trial:
+                return False
+            if time.monotonic() - opened_at >= self.reset_timeout:
+                self.__trial.add(endpoint)
+                return True
+            return False
+
+    def record_success(self, endpoint):
+        with self.__lock:
+            self.__failures.pop(endpoint, None)
+            self.__opened_at.pop(endpoint, None)
+            self.__trial.discard(endpoint)
+
+    def record_failure(self, endpoint):
+        with self.__lock:
+            failures = self.__failures.get(endpoint, 0) + 1
+            self.__failures[endpoint] = failures
+            if endpoint in self.__trial or failures >= self.failure_threshold:
+                self.__opened_at[endpoint] = time.monotonic()
+                self.__trial.discard(endpoint)
+
+    def release(self, endpoint):
+        """Ends a trial request that was abandoned without an outcome, e.g. cancelled."""
+        with self.__lock:
+            self.__trial.discard(endpoint)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to throttling (additive increase, multiplicative decrease).
+
+    The limit halves whenever the server answers 429 and grows by roughly one
+    slot for every `limit` successful requests.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = initial
+        self.in_flight = 0
+        self.__condition = threading.Condition()
+
+    def try_acquire(self):
+        with self.__condition:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        with self.__condition:
+            self.in_flight -= 1
+            self.__condition.notify()
+
+    @contextmanager
+    def slot(self):
+        with self.__condition:
+            while self.in_flight >= int(self.limit):
+                self.__condition.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self):
+        with self.__condition:
+            previous = int(self.limit)
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if int(self.limit) > previous:
+                self.__condition.notify()
+
+    def on_throttled(self):
+        with self.__condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class RetryPolicy:
+    """Retry, backoff and rate-limit handling for HTTP requests.
+
+    Failed requests are retried with full-jitter exponential backoff, honouring
+    `Retry-After` when the server sends it. A 5xx is only retried for idempotent
+    methods, since the server may already have acted on it. A `CircuitBreaker` stops requests to
+    endpoints that keep failing, and an `AdaptiveLimiter` caps concurrency.
+    Pass the same policy to several clients to share the breaker and limiter.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(
+        self,
+        max_retries=3,
+        backoff=0.5,
+        max_backoff=30,
+        breaker=None,
+        limiter=None,
+    ):
+        """Initializes a new retry policy.
+
+        Args:
+        max_retries (int): Retries after the first attempt.
+        backoff (float): Base delay in seconds, doubled on each retry.
+        max_backoff (float): Upper bound of the backoff delay.
+        breaker (CircuitBreaker): Circuit breaker to use. One is created if omitted.
+        limiter (AdaptiveLimiter): Concurrency limiter to use. One is created if omitted.
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.limiter = limiter or AdaptiveLimiter()
+
+    @staticmethod
+    def endpoint(url):
+        """Groups URLs by host and path, ignoring ids in the path."""
+        parts = urlsplit(url)
+        return parts.netloc + re.sub(r"\d+", "N", parts.path)
+
+    @staticmethod
+    def parse_retry_after(value):
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def is_retryable_status(self, method, status):
+        """Decides whether a response status may be retried.
+
+        429 means the request was not processed. A 5xx may come back after the
+        server acted on the request, so it is only retried for idempotent methods.
+        """
+        if status == 429:
+            return True
+        return (
+            status in self.RETRY_STATUSES and method.upper() in self.IDEMPOTENT_METHODS
+        )
+
+    def is_retryable_error(self, method, error):
+        """Decides whether a connection-level error may be retried.
+
+        Requests that may have reached the server are only retried for idempotent methods.
+        """
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        return method.upper() in self.IDEMPOTENT_METHODS
+
+    def send(self, send, method, url, retry=True, **kwargs):
+        """Sends a request through `send`, retrying it according to the policy.
+
+        Args:
+        send (callable): Sends one request, e.g. `requests.Session.request`.
+        method (str): The HTTP method.
+        url (str): The request URL.
+        retry (bool): Whether to retry at all. Requests with a streamed body cannot be replayed.
+        """
+        endpoint = self.endpoint(url)
+        retries = self.max_retries if retry else 0
+        attempt = 0
+        while True:
+            if not self.breaker.allow(endpoint):
+                raise CircuitOpenError(
+                    f"Too many failures, requests to {endpoint} are suspended"
+                )
+            try:
+                with self.limiter.slot():
+                    response = send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.record_failure(endpoint)
+                if attempt >= retries or not self.is_retryable_error(method, e):
+                    raise
+                time.sleep(self.delay(attempt))
+                attempt += 1
+                continue
+            except Exception:
+                self.breaker.record_failure(endpoint)
+                raise
+            except BaseException:
+                self.breaker.release(endpoint)
+                raise
+            if response.status_code not in self.RETRY_STATUSES:
+                self.breaker.record_success(endpoint)
+                self.limiter.on_success()
+                return response
+            if response.status_code == 429:
+                self.limiter.on_throttled()
+            self.breaker.record_failure(endpoint)
+            if attempt >= retries or not self.is_retryable_status(
+                method, response.status_code
+            ):
+                return response
+            retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+            response.close()
+            time.sleep(self.delay(attempt, retry_after))
+            attempt += 1
+
+
+class PooledAccount:
+    """An account in an `AccountPool` with its rate budget and in-flight count."""
+
+    def __init__(self, client, bucket):
+        self.client = client
+        self.bucket = bucket
+        self.in_flight = 0
+
+    def __repr__(self):
+        return f"<PooledAccount {self.client.username} in_flight={self.in_flight}>"
+
+
+class AccountPool:
+    """Schedules actions across many authenticated accounts.
+
+    Each account is a separate `Threads` client with its own cookie file and
+    token state, and its own token bucket limiting how fast actions are sent
+    from it. `acquire` picks an account with budget left, either the one with
+    the fewest actions in flight ("least_loaded") or the next one in turn
+    ("round_robin"), and waits for budget when every account is exhausted.
+    """
+
+    POLICIES = ("least_loaded", "round_robin")
+
+    def __init__(
+        self,
+        policy="least_loaded",
+        session_dir=".",
+        rate=1.0,
+        burst=10,
+        retry_policy=None,
+        instrumentation=None,
+        session_backend=None,
+    ):
+        """Initializes a new account pool.
+
+        Args:
+        policy (str): "least_loaded" or "round_robin".
+        session_dir (str): Directory holding one cookie file per account.
+        rate (float): Default actions per second allowed for each account.
+        burst (int): Default number of actions an account may send back to back.
+        retry_policy (RetryPolicy): Retry policy shared by the clients the pool creates.
+        instrumentation (Instrumentation): Instrumentation shared by the clients the pool creates.
+        session_backend (callable): Returns the session backend of a username, e.g. `lambda name: SQLiteSessionBackend(name)`. Defaults to one file per account in `session_dir`.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError(f"policy must be one of {', '.join(self.POLICIES)}")
+        self.policy = policy
+        self.session_dir = session_dir
+        self.rate = rate
+        self.burst = burst
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.instrumentation = instrumentation or Instrumentation()
+        self.session_backend = session_backend
+        self.accounts = []
+        self.__next = 0
+        self.__condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def add(self, username, password=None, client=None, rate=None, burst=None):
+        """Adds an account to the pool.
+
+        Args:
+        username (str): The account username.
+        password (str): The account password, used if the account has no saved session.
+        client (Threads): An existing client to use instead of creating one.
+        rate (float): Actions per second for this account. Defaults to the pool rate.
+        burst (int): Burst size for this account. Defaults to the pool burst.
+
+        Returns:
+        Threads: The client of the account.
+        """
+        if client is None:
+            state = SessionState(
+                os.path.join(self.session_dir, f"{username}_cookies.pkl"),
+                instrumentation=self.instrumentation,
+                backend=self.session_backend and self.session_backend(username),
+            )
+            client = Threads(
+                username=username,
+                password=password,
+                state=state,
+                retry_policy=self.retry_policy,
+                instrumentation=self.instrumentation,
+            )
+        bucket = TokenBucket(
+            self.rate if rate is None else rate,
+            self.burst if burst is None else burst,
+        )
+        with self.__condition:
+            self.accounts.append(PooledAccount(client, bucket))
+            self.__condition.notify_all()
+        return client
+
+    def __candidates(self):
+        if self.policy == "round_robin":
+            start = self.__next % len(self.accounts)
+            return self.accounts[start:] + self.accounts[:start]
+        return sorted(
+            self.accounts,
+            key=lambda account: (account.in_flight, -account.bucket.available),
+        )
+
+    def __pick(self):
+        wait_for = None
+        for account in self.__candidates():
+            account_wait = account.bucket.try_acquire()
+            if not account_wait:
+                if self.policy == "round_robin":
+                    self.__next = self.accounts.index(account) + 1
+                return account, 0
+            wait_for = account_wait if wait_for is None else min(wait_for, account_wait)
+        return None, wait_for
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Reserves budget on one account and yields its client.
+
+        Args:
+        timeout (float): Seconds to wait for budget before raising TimeoutError. Waits forever if None.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            while True:
+                account, wait_for = self.__pick() if self.accounts else (None, None)
+                if account:
+                    account.in_flight += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No account has budget left")
+                if wait_for is None or (remaining is not None and remaining < wait_for):
+                    wait_for = remaining
+                self.__condition.wait(wait_for)
+        try:
+            yield account.client
+        finally:
+            with self.__condition:
+                account.in_flight -= 1
+                self.__condition.notify_all()
+
+    def run(self, action, *args, timeout=None, **kwargs):
+        """Runs a `Threads` method on the next available account.
+
+        Example:
+        pool.run("follow", username="someone")
+        """
+        with self.acquire(timeout=timeout) as client:
+            return getattr(client, action)(*args, **kwargs)
+
+    def map(self, action, calls, max_workers=8):
+        """Runs a `Threads` method for each set of arguments, spread across accounts.
+
+        Args:
+        action (str): Name of the `Threads` method, e.g. "like".
+        calls (iterable): Each item is a tuple of positional arguments or a dict of keyword arguments.
+        max_workers (int): Maximum number of actions in flight across the pool.
+
+        Returns:
+        list: The result of each call, in order.
+        """
+
+        def call(arguments):
+            if isinstance(arguments, dict):
+                return self.run(action, **arguments)
+            return self.run(action, *arguments)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(call, calls))
+
+
 class Threads:
     """Threads API wrapper for Python 3.9+ (unofficial)
 
     This class provides methods to interact with the Threads API, including logging in, posting, liking, deleting, replying, quoting, reposting, and more.
     """
 
-    def __init__(self, username=None, password=None):
+    def __init__(
+        self,
+        username=None,
+        password=None,
+        user_ids=None,
+        state=None,
+        retry_policy=None,
+        session=None,
+        instrumentation=None,
+        pool_size=10,
+        media_cache=None,
+        preprocessor=None,
+    ):
         """Initializes a new instance of the Threads class.
 
+        One instance can be shared by many threads. Set `pool_size` to the
+        number of threads so that each of them can keep a connection open.
+
         Args:
         username (str): The username to use for authentication.
         password (str): The password to use for authentication.
+        user_ids (UserIdResolver): Username to user id cache, can be shared between clients.
+        state (SessionState): The cookie state of this account. Defaults to `encrypted_cookies.pkl`.
+        retry_policy (RetryPolicy): Retry, backoff and rate-limit handling, can be shared between clients.
+        session (requests.Session): Session to send requests with, e.g. one with custom transport adapters mounted.
+        instrumentation (Instrumentation): Receives per-phase timings and request and action counters.
+        pool_size (int): Maximum number of pooled connections per host, ignored if `session` is given.
+        media_cache (MediaCache): Fingerprints, dimensions and upload ids of uploaded media, can be shared between clients.
+        preprocessor (preprocess.ImagePreprocessor): Downscales and re-encodes images before they are uploaded.
         """
-        self.__session = requests.Session()
+        self.__session = session or create_session(pool_size)
+        self.__retry_policy = retry_policy or RetryPolicy()
+        self.__instrumentation = instrumentation or Instrumentation()
+        self.__state = state or SessionState(instrumentation=self.__instrumentation)
+        self.__session.cookies = self.__state.cookies
+        self.__tokens = TokenProvider(self.__fetch_token_page, self.__state)
+        self.__user_ids = user_ids or UserIdResolver()
+        self.__media_cache = media_cache or MediaCache()
+        self.__preprocessor = preprocessor
+        self.__templates = RequestTemplates()
         self.username = username
         self.password = password
         self.__timestamp = int((time.time() * 1000))
         self.authenticated = False
-        __key = os.getenv("FERNET_KEY")
-
-        self.__cipher_suite = Fernet(f"{__key}".encode())
+        self.__login_lock = threading.Lock()
+        self.__ledger = None
 
     def login_required(func):
         @wraps(func)
         def wrapper(self, *args, **kwargs):
-            if os.path.exists("encrypted_cookies.pkl"):
-                self.__session.cookies = self.__get_cookies()
-
-                self.authenticated = True
-
             if not self.authenticated:
-                print("I am not authenticated")
-                if self.username and self.password:
-                    self.login()
-                else:
-                    raise PermissionError("Login required to access this method")
+                with self.__login_lock:
+                    if not self.authenticated and self.__state.load():
+                        self.authenticated = True
+
+                    if not self.authenticated:
+                        logger.debug("Not authenticated, logging in")
+                        if self.username and self.password:
+                            self.login()
+                        else:
+                            raise PermissionError(
+                                "Login required to access this method"
+                            )
             return func(self, *args, **kwargs)
 
         return wrapper
 
+    def __send(self, method, url, headers, **kwargs):
+        send = self.__session.request
+        if self.__instrumentation.enabled:
+            send = self.__timed(send)
+        return self.__retry_policy.send(send, method, url, headers=headers, **kwargs)
+
+    def __timed(self, send):
+        """Wraps `send` to record the duration and status of every attempt."""
+        instrumentation = self.__instrumentation
+
+        def timed_send(method, url, **kwargs):
+            status = None
+            start = time.perf_counter()
+            try:
+                response = send(method, url, **kwargs)
+                status = response.status_code
+                return response
+            finally:
+                seconds = time.perf_counter() - start
+                instrumentation.record_phase("network", seconds)
+                instrumentation.record_request(
+                    method, RetryPolicy.endpoint(url), status, seconds
+                )
+
+        return timed_send
+
     def __send_request_with_auth(self, method, url, headers, **kwargs):
-        cookies = self.__get_cookies()
-        self.__session.cookies.update(cookies)
-        response = self.__session.request(method, url, headers=headers, **kwargs)
+        response = self.__send(method, url, headers=headers, **kwargs)
         response.raise_for_status()
-        self.__encrypt_cookies(self.__session.cookies)
+        self.__state.mark_changed()
         return response
 
     def __send_request_without_auth(
@@ -130,152 +2553,245 @@ class Threads:
         headers=Constants.BASIC_HEADERS,
         **kwargs,
     ):
-        response = self.__session.request(method, endpoint, headers=headers, **kwargs)
+        response = self.__send(method, endpoint, headers=headers, **kwargs)
         response.raise_for_status()
         return response
 
-    def __encrypt_cookies(self, cookies):
-        with open("encrypted_cookies.pkl", "wb") as f:
-            pickle.dump(cookies, f)
-
-    def __get_cookies(self):
-        with open("encrypted_cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            self.__session.cookies.update(cookies)
-            return cookies
-
     def __get_cookie_item(self, cookie_name):
-        cookie = self.__get_cookies()
-        return cookie.get(cookie_name, "")
-
-        # return cookie.split(f"{cookie_name}=")[1].split(";")[0]
+        return self.__state.get(cookie_name, "")
 
-    @login_required
-    def __extract_fb_dtsg(self):
-        try:
-            response = self.__send_request_with_auth(
-                url=Constants.BASE_URL,
-                method="GET",
-                cookies=self.__get_cookies(),
-                headers=Constants.BASIC_HEADERS,
-            )
-
-            html = response.text
-            soup = BeautifulSoup(html, "html.parser")
-            fb_dtsg = json.loads(soup.find("script", {"id": "__eqmc"}).get_text())["f"]
-            return fb_dtsg
-        except Exception as e:
-            print("Error:", e)
-            return None
+    def __fetch_token_page(self):
+        return self.__send_request_with_auth(
+            url=Constants.BASE_URL,
+            method="GET",
+            headers=Constants.BASIC_HEADERS,
+            stream=True,
+        )
 
     def __get_fb_dtsg(self):
-        fb_dtsg = self.__get_cookie_item("fb_dtsg") or self.__extract_fb_dtsg()
-        if fb_dtsg:
-            self.__session.cookies.update({"fb_dtsg": fb_dtsg})
-            self.__encrypt_cookies(self.__session.cookies)
-        return fb_dtsg
+        return self.__tokens.get("fb_dtsg")
+
+    def __send_graphql_request(self, headers, data):
+        response = self.__send_request_with_auth(
+            method="POST",
+            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
+            headers=headers,
+            data=data,
+        )
+        sent = data["fb_dtsg"]
+        sent = sent[0] if isinstance(sent, list) else sent
+        if self.__tokens.is_auth_error(response) and self.__tokens.refresh(
+            force=False, rejected=sent
+        ):
+            fb_dtsg = self.__tokens.get("fb_dtsg")
+            data = {
+                **data,
+                "fb_dtsg": [fb_dtsg] if isinstance(data["fb_dtsg"], list) else fb_dtsg,
+            }
+            headers = {**headers, "x-csrftoken": self.__tokens.get("csrftoken")}
+            response = self.__send_request_with_auth(
+                method="POST",
+                url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
+                headers=headers,
+                data=data,
+            )
+        return response
 
     def __get_media_dimensions(self, file_path):
-        try:
-            mime_type, _ = mimetypes.guess_type(file_path)
-            if mime_type.startswith("image"):
-                with Image.open(file_path) as img:
-                    return img.size
-            elif mime_type.startswith("video"):
-                with VideoFileClip(file_path) as video:
-                    return video.size
-            else:
-                raise ValueError("Unsupported media type.")
-        except Exception as e:
-            print(e)
-            return 500, 500
+        return get_media_dimensions(file_path)
 
     def __upload_image(
         self,
         media_path,
         supported_types=["image", "video"],
         is_sidecar=False,
+        reuse=True,
+        reused=None,
+        claims=None,
+        position=0,
     ):
+        """Uploads one image or video and returns its upload id.
+
+        Args:
+        reuse (bool): Use an upload id from the media cache if there is one.
+        reused (set): Collects the upload ids that were served from the cache.
+        claims (dict): Content digest to the position of the child that claimed it, shared by the children of one sidecar.
+        position (int): The position of this child in the sidecar.
+        """
         if not os.path.exists(media_path):
-            print("The path provided is not a valid file path.")
-            exit()
+            raise FileNotFoundError("The path provided is not a valid file path.")
         mime_type, _ = mimetypes.guess_type(media_path)
 
         if not mime_type or mime_type.split("/")[0] not in supported_types:
-            print("The file type is not supported.")
-            exit()
+            raise ValueError("The file type is not supported.")
+
+        cache = self.__media_cache
+        digest = cache.fingerprint(media_path)
+        cover_path = None
+        if self.__preprocessor and self.__preprocessor.accepts(mime_type):
+            prepared = self.__preprocessor.prepare(media_path, digest)
+            media_path, mime_type = prepared.path, prepared.mime_type
+            cover_path = prepared.cover_path
+            digest = cache.fingerprint(media_path)
+            cache.dimensions(digest, lambda: (prepared.width, prepared.height))
+        if claims is not None and claims.setdefault(digest, position) != position:
+            # The same content in another child of this sidecar needs an
+            # upload id of its own.
+            reuse = False
+        scope = f"{self.__get_cookie_item('ds_user_id')}:{int(is_sidecar)}"
+
+        def upload():
+            return self.__send_media(
+                media_path, mime_type, digest, is_sidecar, cover_path
+            )
 
-        media_type = "photo" if mime_type.startswith("image") else "video"
+        if not reuse:
+            upload_id = upload()
+            cache.store_upload(scope, digest, upload_id)
+            return upload_id
+        return cache.upload(scope, digest, upload, reused)
 
-        with open(media_path, "rb") as file:
-            media_data = file.read()
+    def __send_media(self, media_path, mime_type, digest, is_sidecar, cover_path=None):
+        width, height = self.__media_cache.dimensions(
+            digest, lambda: self.__get_media_dimensions(media_path)
+        )
+        timestamp = new_upload_id()
+
+        URL, headers = build_upload_request(
+            media_path,
+            mime_type,
+            timestamp,
+            width,
+            height,
+            is_sidecar,
+            extract_cover_frame=cover_path is None,
+        )
+        offset = self.__rupload(media_path, URL, headers)
+        logger.debug(
+            "Uploaded %s",
+            media_path,
+            extra={"event": "upload", "upload_id": timestamp, "offset": offset},
+        )
+        if cover_path:
+            URL, headers = build_upload_request(
+                cover_path, "image/jpeg", timestamp, width, height, is_sidecar
+            )
+            self.__rupload(cover_path, URL, headers)
 
-        width, height = self.__get_media_dimensions(media_path)
-        sidecar = "1" if is_sidecar else "0"
-        timestamp = int((time.time() * 1000))
+        return timestamp
 
-        X_INSTAGRAM_RUPLOAD_PARAMS = {
-            "is_sidecar": "1" if is_sidecar else "0",
-            "is_threads": "1",
-            "media_type": 1 if media_type == "photo" else 2,
-            "upload_id": timestamp,
-            "upload_media_height": height,
-            "upload_media_width": width,
-        }
-        if media_type == "video":
-            X_INSTAGRAM_RUPLOAD_PARAMS["extract_cover_frame"] = "1"
+    def __rupload(self, media_path, URL, headers):
+        """Sends a file to a rupload URL, resuming after failed attempts.
 
-        headers = {
-            "accept": "*/*",
-            "accept-language": "en-US,en;q=0.9",
-            "cache-control": "no-cache",
-            "content-type": mime_type,
-            "dpr": "1",
-            "offset": "0",
-            "pragma": "no-cache",
-            "sec-ch-prefers-color-scheme": "dark",
-            "sec-ch-ua": '"Google Chrome";v="117", "Not;A=Brand";v="8", "Chromium";v="117"',
-            "sec-ch-ua-full-version-list": '"Google Chrome";v="117.0.5938.149", "Not;A=Brand";v="8.0.0.0", "Chromium";v="117.0.5938.149"',
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-model": '""',
-            "sec-ch-ua-platform": '"Windows"',
-            "sec-ch-ua-platform-version": '"15.0.0"',
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "same-origin",
-            "viewport-width": "1280",
-            "x-entity-length": str(os.path.getsize(media_path)),
-            "x-entity-name": f"fb_uploader_{timestamp}",
-            "x-entity-type": mime_type,
-            "x-instagram-rupload-params": json.dumps(X_INSTAGRAM_RUPLOAD_PARAMS),
-            "Referer": "https://www.threads.net/@topacipolta._gnarly_",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
+        Returns:
+        int: The offset the last attempt started from.
+        """
+        offset = 0
+        for attempt in range(Constants.UPLOAD_RETRIES + 1):
+            try:
+                # requests streams file objects from their current position
+                # and sets content-length to the remaining size.
+                with open(media_path, "rb") as file:
+                    file.seek(offset)
+                    # Raises for error statuses, the body is not needed.
+                    self.__send_request_with_auth(
+                        url=URL,
+                        method="POST",
+                        headers={**headers, "offset": str(offset)},
+                        data=file,
+                        retry=False,
+                    )
+                break
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.HTTPError,
+            ) as e:
+                status = getattr(e.response, "status_code", None)
+                if attempt == Constants.UPLOAD_RETRIES or (
+                    status and status not in RetryPolicy.RETRY_STATUSES
+                ):
+                    raise
+                time.sleep(self.__retry_policy.delay(attempt))
+                offset = self.__get_upload_offset(URL, headers)
+        return offset
+
+    def __upload_media(self, media_path, max_workers, reuse=True, reused=None):
+        """Uploads the media of a thread and returns their upload ids.
+
+        Upload ids served from the media cache are added to `reused`.
+        """
+        if len(media_path) > 1:
+            return self.__upload_sidecar(media_path, max_workers, reuse, reused)
+        return [
+            self.__upload_image(path, reuse=reuse, reused=reused) for path in media_path
+        ]
 
-        URL = f"https://www.threads.net/rupload_ig{media_type}/fb_uploader_{timestamp}"
-        response = self.__send_request_with_auth(
-            url=URL,
-            method="POST",
-            headers={**Constants.BASIC_HEADERS, **headers},
-            data=media_data.decode("latin-1"),
-        )
-        print(response.json())
+    def __upload_sidecar(self, media_path, max_workers, reuse=True, reused=None):
+        """Uploads the children of a sidecar concurrently.
 
-        response.raise_for_status()
-        return timestamp
+        Returns the upload ids in the order of `media_path`. If an upload fails,
+        the uploads that have not started yet are cancelled and the error is raised.
+        """
+        claims = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(
+                    self.__upload_image,
+                    path,
+                    is_sidecar=True,
+                    reuse=reuse,
+                    reused=reused,
+                    claims=claims,
+                    position=position,
+                )
+                for position, path in enumerate(media_path)
+            ]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in pending:
+                future.cancel()
+            for future in futures:
+                if future in done and future.exception():
+                    raise future.exception()
+            return [future.result() for future in futures]
+
+    def __get_upload_offset(self, url, headers):
+        """Asks the upload endpoint how many bytes it has already received."""
+        try:
+            response = self.__send_request_with_auth(
+                url=url, method="GET", headers=headers
+            )
+            return int(response.json().get("offset", 0))
+        except (requests.RequestException, ValueError):
+            return 0
+
+    def __get_postid(self, thread):
+        """Returns the `<media id>_<user id>` post id of one of our own threads.
 
-    def __get_postid(self):
-        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-        id = 0
-        shortcode = self.get_shortcode()
-        print(shortcode)
-        for char in shortcode:
-            id = (id * 64) + alphabet.index(char)
-        print(id)
-        return str(id)
+        Args:
+        thread (str): A media id, post id, shortcode or post URL.
+        """
+        return shortcode.to_post_id(thread, self.__get_cookie_item("ds_user_id"))
 
     @login_required
     def get_user_id(self, username):
+        return self.__user_ids.resolve(username, self.__search_user_id)
+
+    @login_required
+    def resolve_user_ids(self, usernames, max_workers=8):
+        """Resolves many usernames at once.
+
+        Returns:
+        dict: The user id (or None) of each distinct username.
+        """
+        return self.__user_ids.resolve_many(
+            usernames, self.__search_user_id, max_workers=max_workers
+        )
+
+    def __search_user_id(self, username):
+        # Usernames are case-insensitive and cached lowercased, so any spelling
+        # has to find the account.
+        username = username.lower()
         addional_headers = {
             "cookie": f"mid={self.__get_cookie_item('mid')}; csrftoken={self.__get_cookie_item('csrftoken')}; ds_user_id={self.__get_cookie_item('ds_user_id')}; sessionid={self.__get_cookie_item('sessionid')};",
             "x-csrftoken": self.__get_cookie_item("csrftoken"),
@@ -287,43 +2803,189 @@ class Threads:
             headers={**Constants.BASIC_HEADERS, **addional_headers},
         )
         for item in response.json().get("users"):
-            if item["user"]["username"] == username:
+            if item["user"]["username"].lower() == username:
                 return item["user"]["pk"]
         return None
 
+    def __mutate(self, doc_name, target):
+        with self.__instrumentation.phase("token_fetch"):
+            fb_dtsg = self.__get_fb_dtsg()
+            csrftoken = self.__tokens.get("csrftoken")
+            lsd = self.__tokens.peek("lsd")
+        with self.__instrumentation.phase("serialization"):
+            headers, data = self.__templates.prepare(
+                doc_name, target, fb_dtsg, csrftoken, lsd
+            )
+        return self.__send_graphql_request(headers=headers, data=data)
+
+    def __json(self, response):
+        with self.__instrumentation.phase("serialization"):
+            return response.json()
+
     @login_required
-    def __perform_action(self, variables, doc_id, action_name):
-        fb_dtsg = self.__get_fb_dtsg()
+    def __perform_action(self, doc_name, target, action_name):
+        response = self.__mutate(doc_name, target)
+        errors = self.__json(response).get("errors")
+        self.__instrumentation.record_action(doc_name, not errors)
+
+        extra = {"event": "action", "action": doc_name, "target": target}
+        if not errors:
+            logger.info("%s succeeded", action_name, extra=extra)
+            return True
+        else:
+            logger.warning(
+                "%s failed: %s", action_name, errors, extra={**extra, "errors": errors}
+            )
+            return False
 
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-ig-app-id": "238260118697367",
-            "x-instagram-ajax": "0",
-            "Referer": "https://www.threads.net/",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
+    def __perform_user_action(self, username, user_id, doc_name, action_name):
+        if not username and not user_id:
+            raise ValueError("Either username or user_id is required")
+        if username:
+            user_id = self.get_user_id(username)
+        return self.__perform_action(doc_name, user_id, action_name)
 
-        data = {
-            "fb_dtsg": [fb_dtsg],
-            "variables": variables,
-            "server_timestamps": ["true"],
-            "doc_id": [doc_id],
-        }
+    def batch(self, max_workers=8):
+        """Starts a batch of GraphQL mutations.
 
-        response = self.__send_request_with_auth(
-            method="POST",
-            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers={**Constants.BASIC_HEADERS, **addional_headers},
-            data=data,
+        Example:
+        threads.batch().follow(username="a").mute(user_id="1").like("123").execute()
+
+        Args:
+        max_workers (int): Maximum number of requests in flight at once.
+        """
+        return ThreadsBatch(self.__execute_batch, max_workers)
+
+    @login_required
+    def __execute_batch(self, batch, max_workers):
+        results = [None] * len(batch.items)
+        user_ids = {}
+
+        def resolve(username):
+            try:
+                user_ids[username] = self.get_user_id(username)
+            except Exception as e:
+                user_ids[username] = e
+
+        def send(index, action, target, headers, data):
+            try:
+                response = self.__send_graphql_request(headers=headers, data=data)
+                errors = self.__json(response).get("errors")
+                self.__instrumentation.record_action(batch.ACTIONS[action], not errors)
+                results[index] = BatchResult(
+                    action, target, not errors, response, errors or None
+                )
+            except Exception as e:
+                results[index] = BatchResult(action, target, False, error=e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            usernames = {username for _, username, _ in batch.items if username}
+            list(pool.map(resolve, usernames))
+
+            fb_dtsg = self.__get_fb_dtsg()
+            csrftoken = self.__tokens.get("csrftoken")
+            lsd = self.__tokens.peek("lsd")
+
+            requests_to_send = []
+            for index, (action, username, target) in enumerate(batch.items):
+                if username:
+                    target = user_ids[username]
+                    if target is None or isinstance(target, Exception):
+                        results[index] = BatchResult(
+                            action,
+                            username,
+                            False,
+                            error=target or f"User {username} not found",
+                        )
+                        continue
+                headers, data = self.__templates.prepare(
+                    batch.ACTIONS[action], target, fb_dtsg, csrftoken, lsd
+                )
+                requests_to_send.append((index, action, target, headers, data))
+
+            for request in requests_to_send:
+                pool.submit(send, *request)
+
+        return results
+
+    def __fetch_notifications(self, cursor, page_size):
+        headers, data = self.__templates.prepare_query(
+            "GET_NOTIFICATION",
+            {"first": page_size, "after": cursor},
+            self.__get_fb_dtsg(),
+            self.__tokens.get("csrftoken"),
+            self.__tokens.peek("lsd"),
         )
+        payload = self.__json(self.__send_graphql_request(headers=headers, data=data))
+        if payload.get("errors"):
+            raise ValueError(f"Failed to fetch notifications: {payload['errors']}")
+        return find_connection(payload.get("data"))
 
-        if not response.json().get("errors"):
-            print(f"{action_name} successfully!")
-            return True
-        else:
-            print(f"Failed to {action_name}!")
-            return False
+    @login_required
+    def iter_notification_pages(self, cursor=None, page_size=20, max_pages=None):
+        """Yields pages of notifications, fetching the next page in the background.
+
+        Args:
+        cursor (str): Cursor to resume from, as yielded with an earlier page.
+        page_size (int): Number of notifications requested per page.
+        max_pages (int): Stop after this many pages.
+
+        Yields:
+        tuple: The notifications of a page and the cursor to resume after it.
+        """
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(self.__fetch_notifications, cursor, page_size)
+            pages = 0
+            while future is not None:
+                nodes, cursor, has_next_page = future.result()
+                pages += 1
+                future = None
+                if (
+                    has_next_page
+                    and cursor
+                    and (max_pages is None or pages < max_pages)
+                ):
+                    future = pool.submit(self.__fetch_notifications, cursor, page_size)
+                yield nodes, cursor
+
+    def iter_notifications(self, cursor=None, page_size=20, max_pages=None):
+        """Yields notifications one by one, see `iter_notification_pages`."""
+        for nodes, _ in self.iter_notification_pages(cursor, page_size, max_pages):
+            yield from nodes
+
+    @login_required
+    def mark_read(self, notification_ids, batch_size=50):
+        """Marks notifications as read, sending the ids in batches.
+
+        Raises ValueError while `Constants.DOC_IDS["MARK_NOTIFICATIONS_READ"]`
+        is the doc id of LIKE, as shipped, instead of sending like mutations.
+        Set the doc id of the mark-read query before creating the client.
+
+        Returns:
+        bool: True if every batch was acknowledged.
+        """
+        self.__templates.check_distinct("MARK_NOTIFICATIONS_READ", "LIKE")
+        notification_ids = list(notification_ids)
+        ok = True
+        for start in range(0, len(notification_ids), batch_size):
+            headers, data = self.__templates.prepare_query(
+                "MARK_NOTIFICATIONS_READ",
+                {"notification_ids": notification_ids[start : start + batch_size]},
+                self.__get_fb_dtsg(),
+                self.__tokens.get("csrftoken"),
+                self.__tokens.peek("lsd"),
+            )
+            response = self.__send_graphql_request(headers=headers, data=data)
+            errors = self.__json(response).get("errors")
+            self.__instrumentation.record_action("MARK_NOTIFICATIONS_READ", not errors)
+            if errors:
+                logger.warning(
+                    "Failed to mark notifications as read: %s",
+                    errors,
+                    extra={"event": "action", "action": "MARK_NOTIFICATIONS_READ"},
+                )
+                ok = False
+        return ok
 
     def login(self):
         if not self.username or not self.password:
@@ -356,95 +3018,30 @@ class Threads:
             data=payload,
         )
 
+        extra = {"event": "login", "username": self.username}
         try:
-            if response.json()["authenticated"] == True:
+            if self.__json(response)["authenticated"] == True:
                 self.authenticated = True
-                print("Logged in successfully!")
+                logger.info("Logged in as %s", self.username, extra=extra)
 
                 try:
-                    headers["x-csrftoken"] = response.cookies["csrftoken"]
-                    sessionid = response.cookies.get("sessionid", "")
-                    ds_user_id = response.cookies.get("ds_user_id", "")
-                    ig_did = response.cookies.get("ig_did", "")
-                    mid = response.cookies.get("mid", "")
-                    rur = response.cookies.get("rur", "")
-                    csrf_token = response.cookies.get("csrftoken", "")
-                    custom_cookie = f"sessionid={sessionid}; ds_user_id={ds_user_id}; ig_did={ig_did}; mid={mid}; rur={rur} csrftoken={csrf_token}"
-                    print(self.__session.cookies.get_dict())
-
-                    self.__encrypt_cookies(self.__session.cookies)
-                except Exception as e:
-                    print(e)
-                    print("Failed to encrypt session")
+                    self.__state.flush()
+                except Exception:
+                    logger.exception("Failed to save the session", extra=extra)
 
             else:
-                print("Login failed!")
-        except Exception as e:
-            print(e)
+                logger.warning("Login failed for %s", self.username, extra=extra)
+        except Exception:
+            logger.exception("Login failed for %s", self.username, extra=extra)
+        return self.authenticated
 
     @login_required
     def like(self, post_id):
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-fb-friendly-name": "useBarcelonaLikeMutationLikeMutation",
-            "x-fb-lsd": "kUS5ScWK1mWaeRscjA50tY",
-            "x-ig-app-id": "238260118697367",
-            "Referer": "https://www.threads.net/@saver.bot/post/CyFAoogKvFi",
-            "Referrer-Policy": "origin-when-cross-origin",
-            # "cookie": f"mid={self.__get_cookie_item('mid')}; csrftoken={self.__get_cookie_item('csrftoken')}; ds_user_id={self.__get_cookie_item('ds_user_id')}; sessionid={self.__get_cookie_item('sessionid')}",
-        }
-
-        headers = {**Constants.BASIC_HEADERS, **addional_headers}
-        fb_dtsg = self.__get_fb_dtsg()
-        # exit()
-
-        payload = {
-            "fb_dtsg": [fb_dtsg],
-            "variables": [f'{{"media_id":"{post_id}"}}'],
-            "server_timestamps": ["true"],
-            "doc_id": [f"{Constants.DOC_IDS['LIKE']}"],
-        }
-
-        response = self.__send_request_with_auth(
-            method="POST",
-            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers=headers,
-            data=payload,
-        )
-
-        print(response.json())
+        return self.__perform_action("LIKE", post_id, "like")
 
     @login_required
     def unlike(self, post_id):
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-fb-friendly-name": "useBarcelonaLikeMutationLikeMutation",
-            "x-fb-lsd": "kUS5ScWK1mWaeRscjA50tY",
-            "x-ig-app-id": "238260118697367",
-            "Referer": "https://www.threads.net/@saver.bot/post/CyFAoogKvFi",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
-
-        headers = {**Constants.BASIC_HEADERS, **addional_headers}
-        fb_dtsg = self.__get_fb_dtsg()
-        # exit()
-
-        payload = {
-            "fb_dtsg": [fb_dtsg],
-            "variables": [f'{{"media_id":"{post_id}"}}'],
-            "server_timestamps": ["true"],
-            "doc_id": [f"{Constants.DOC_IDS['UNLIKE']}"],
-        }
-
-        response = self.__send_request_with_auth(
-            "POST",
-            Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers=headers,
-            data=payload,
-        )
-        print(response.json())
+        return self.__perform_action("UNLIKE", post_id, "unlike")
 
     @login_required
     def create_thread(
@@ -453,7 +3050,54 @@ class Threads:
         media_path: list = [],
         reply_to: str = None,
         quoted_thread_id: str = None,
+        max_upload_workers: int = 4,
+    ):
+        media_path = media_path or []
+        reused = set()
+        upload_ids = self.__upload_media(media_path, max_upload_workers, reused=reused)
+        return self.__configure_thread(
+            message,
+            upload_ids,
+            reply_to,
+            quoted_thread_id,
+            media_path,
+            max_upload_workers,
+            reused,
+        )
+
+    def __configure_thread(
+        self,
+        message,
+        upload_ids,
+        reply_to,
+        quoted_thread_id,
+        media_path=(),
+        max_upload_workers=4,
+        reused=(),
     ):
+        """Publishes a thread with already uploaded media.
+
+        If the server rejects upload ids that were reused from the media cache,
+        the media is uploaded again and the thread configured once more.
+
+        Args:
+        upload_ids (list): The upload ids of `media_path`, empty for a text-only thread.
+        reused (set): The upload ids that were served from the media cache.
+        """
+        try:
+            return self.__send_configure(
+                message, upload_ids, reply_to, quoted_thread_id
+            )
+        except requests.HTTPError as e:
+            status = getattr(e.response, "status_code", 0)
+            if not 400 <= status < 500 or not reused:
+                raise
+            self.__media_cache.forget_uploads(reused)
+        logger.info("Cached upload ids were rejected, uploading the media again")
+        upload_ids = self.__upload_media(media_path, max_upload_workers, reuse=False)
+        return self.__send_configure(message, upload_ids, reply_to, quoted_thread_id)
+
+    def __send_configure(self, message, upload_ids, reply_to, quoted_thread_id):
         text_post_app_info = (
             {"reply_control": 0, "reply_id": f"{reply_to}"}
             if reply_to
@@ -472,25 +3116,23 @@ class Threads:
                 "Referrer-Policy": "origin-when-cross-origin",
             },
         }
-        if media_path and len(media_path) > 1:
+        if len(upload_ids) > 1:
             URL = Constants.BASE_URL + Constants.CREAET_SIDECAR_MEDIA_THREAD_ENDPOINT
-            children_metadata = []
-            for path in media_path:
-                upload_id = self.__upload_image(path, is_sidecar=True)
-                children_metadata.append({"upload_id": f"{upload_id}"})
+            children_metadata = [
+                {"upload_id": f"{upload_id}"} for upload_id in upload_ids
+            ]
             payload = {
                 "caption": message,
                 "children_metadata": children_metadata,
-                "client_sidecar_id": int((time.time() * 1000)),
+                "client_sidecar_id": new_upload_id(),
                 "is_threads": True,
                 "text_post_app_info": json.dumps(text_post_app_info),
             }
 
-            data = json.dumps(payload)
-
-        elif media_path and len(media_path) == 1:
-            timestamp = self.__upload_image(media_path[0])
+            with self.__instrumentation.phase("serialization"):
+                data = json.dumps(payload)
 
+        elif upload_ids:
             URL = Constants.BASE_URL + Constants.CREATE_SINGLE_MEDIA_THREAD_ENDPOINT
 
             payload = {
@@ -498,7 +3140,7 @@ class Threads:
                 "is_meta_only_post": "",
                 "is_paid_partnership": "",
                 "text_post_app_info": json.dumps(text_post_app_info),
-                "upload_id": timestamp,
+                "upload_id": f"{upload_ids[0]}",
             }
             data = payload
 
@@ -510,7 +3152,7 @@ class Threads:
                 "is_paid_partnership": "",
                 "publish_mode": "text_post",
                 "text_post_app_info": json.dumps(text_post_app_info),
-                "upload_id": f"{int((time.time() * 1000))}",
+                "upload_id": f"{new_upload_id()}",
             }
             data = payload
 
@@ -520,184 +3162,193 @@ class Threads:
             headers=headers,
             data=data,
         )
-        print(response.json())
+        payload = self.__json(response)
+        logger.info(
+            "Thread created", extra={"event": "create_thread", "response": payload}
+        )
+        return payload
 
-    @login_required
-    def delete_thread(self, thread_id):
-        fb_dtsg = self.__get_fb_dtsg()
+    @staticmethod
+    def idempotency_key(post, scope, index):
+        """Returns the idempotency key of the `index`-th spec of a `post_many` call.
 
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-ig-app-id": "238260118697367",
-            "x-instagram-ajax": "0",
-            "Referer": "https://www.threads.net/",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
+        Specs without an explicit `idempotency_key` get a key that is unique to
+        the call (`scope`), so they are never skipped as already published.
+        """
+        if post.get("idempotency_key"):
+            return str(post["idempotency_key"])
+        return f"{scope}:{index}"
 
-        body = {
-            "fb_dtsg": fb_dtsg,
-            "variables": f'{{"media_id":"{thread_id}_52149867531"}}',
-            "server_timestamps": "true",
-            "doc_id": Constants.DOC_IDS["DELETE"],
-        }
+    @login_required
+    def post_many(self, posts, prefetch=4, max_upload_workers=4, ledger=None):
+        """Publishes many threads, uploading the media of later posts while earlier ones are configured.
 
-        response = self.__send_request_with_auth(
-            method="POST",
-            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers={**Constants.BASIC_HEADERS, **addional_headers},
-            data=body,
-        )
+        Posts are configured one at a time in the order given, while the media
+        of up to `prefetch` following posts is probed and uploaded in the
+        background. `posts` is consumed lazily, so it can be a generator, and
+        results are yielded as posts complete. A failing post does not stop the others.
 
-        if response.json():
-            print("Thread deleted successfully!")
-            return True
-        else:
-            print("Failed to delete thread!")
-            return False
+        Every post has an idempotency key, recorded in `ledger`. Posts whose key
+        is already done are not published again and return the stored response;
+        posts whose outcome is unknown, e.g. after a 5xx or a connection error
+        during configure, are reported as failed until their key is discarded.
+        Only posts with an explicit `idempotency_key` are deduplicated, others
+        get a key of their own.
 
-    @login_required
-    def repost(self, thread_id):
-        fb_dtsg = self.__get_fb_dtsg()
+        Example:
+        for result in threads.post_many({"message": m, "media_path": [p]} for m, p in queue):
+            print(result)
 
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-ig-app-id": "238260118697367",
-            "x-instagram-ajax": "0",
-            "Referer": "https://www.threads.net/",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
-        data = {
-            "fb_dtsg": [fb_dtsg],
-            "variables": json.dumps({"media_id": thread_id, "repost_context": None}),
-            "server_timestamps": ["true"],
-            "doc_id": [Constants.DOC_IDS["REPOST"]],
-        }
+        Args:
+        posts (iterable): Messages, or dictionaries with the arguments of `create_thread` and an optional `idempotency_key`.
+        prefetch (int): Maximum number of posts being prepared ahead of the one being configured.
+        max_upload_workers (int): Maximum number of media uploads in flight across all posts.
+        ledger (PostLedger): Where idempotency keys are recorded. Defaults to an in-memory ledger of this client.
 
-        response = self.__send_request_with_auth(
-            method="POST",
-            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers={**Constants.BASIC_HEADERS, **addional_headers},
-            data=data,
-        )
+        Yields:
+        BatchResult: One per post, in the order of `posts`, with the idempotency key as target and the `create_thread` response.
+        """
+        if ledger is None:
+            with self.__login_lock:
+                if self.__ledger is None:
+                    self.__ledger = PostLedger()
+            ledger = self.__ledger
+        posts = enumerate(posts)
+        queue = deque()
+        end = object()
+        scope = os.urandom(8).hex()
+        with ThreadPoolExecutor(max_workers=max_upload_workers) as pool:
+            try:
+                while True:
+                    while len(queue) < max(1, prefetch):
+                        item = next(posts, end)
+                        if item is end:
+                            break
+                        index, post = item
+                        queue.append(
+                            self.__admit_post(post, scope, index, ledger, pool)
+                        )
+                    if not queue:
+                        return
+                    yield self.__publish_post(*queue.popleft(), ledger)
+            finally:
+                # Posts admitted but not published when the caller stops iterating.
+                for key, _, previous, uploads, _ in queue:
+                    if previous is None:
+                        for upload in uploads:
+                            upload.cancel()
+                        ledger.release(key)
+
+    def __admit_post(self, post, scope, index, ledger, pool):
+        """Claims the idempotency key of a post and starts uploading its media."""
+        if isinstance(post, str):
+            post = {"message": post}
+        key = self.idempotency_key(post, scope, index)
+        if not ledger.claim(key):
+            return key, post, ledger.get(key), None, None
+        media_path = post.get("media_path") or []
+        is_sidecar = len(media_path) > 1
+        reused = set()
+        claims = {}
+        uploads = [
+            pool.submit(
+                self.__upload_image,
+                path,
+                is_sidecar=is_sidecar,
+                reused=reused,
+                claims=claims,
+                position=position,
+            )
+            for position, path in enumerate(media_path)
+        ]
+        return key, post, None, uploads, reused
+
+    def __publish_post(self, key, post, previous, uploads, reused, ledger):
+        if previous is not None:
+            state, response = previous
+            if state == PostLedger.DONE:
+                logger.debug("Skipping already published post %s", key)
+                return BatchResult("create_thread", key, True, response)
+            return BatchResult(
+                "create_thread",
+                key,
+                False,
+                error=f"Post {key} is pending or its outcome is unknown",
+            )
+        try:
+            upload_ids = [upload.result() for upload in uploads]
+        except Exception as e:
+            for upload in uploads:
+                upload.cancel()
+            ledger.release(key)
+            return BatchResult("create_thread", key, False, error=e)
+        try:
+            response = self.__configure_thread(
+                post.get("message", ""),
+                upload_ids,
+                post.get("reply_to"),
+                post.get("quoted_thread_id"),
+                post.get("media_path") or [],
+                reused=reused,
+            )
+        except Exception as e:
+            status = getattr(getattr(e, "response", None), "status_code", None) or 0
+            if isinstance(e, CircuitOpenError) or 400 <= status < 500:
+                # Rejected, the post was not published and may be sent again.
+                ledger.release(key)
+            else:
+                logger.warning(
+                    "Outcome of post %s is unknown: %s",
+                    key,
+                    e,
+                    extra={"event": "create_thread", "key": key},
+                )
+            return BatchResult("create_thread", key, False, error=e)
+        ledger.complete(key, response)
+        return BatchResult("create_thread", key, True, response)
 
-        if not response.json().get("errors"):
-            print("Thread reposted successfully!")
-            return True
+    @login_required
+    def delete_thread(self, thread_id):
+        post_id = self.__get_postid(thread_id)
+        response = self.__mutate("DELETE", post_id)
+        deleted = bool(self.__json(response))
+        self.__instrumentation.record_action("DELETE", deleted)
+
+        extra = {"event": "action", "action": "DELETE", "target": post_id}
+        if deleted:
+            logger.info("Thread deleted", extra=extra)
         else:
-            print(response.json())
-            print("Failed to repost thread!")
-            return False
+            logger.warning("Failed to delete thread", extra=extra)
+        return deleted
 
     @login_required
-    def unrepost(self, thread_id):
-        fb_dtsg = self.__get_fb_dtsg()
-
-        addional_headers = {
-            "x-asbd-id": "129477",
-            "x-csrftoken": self.__get_cookie_item("csrftoken"),
-            "x-ig-app-id": "238260118697367",
-            "x-instagram-ajax": "0",
-            "Referer": "https://www.threads.net/",
-            "Referrer-Policy": "origin-when-cross-origin",
-        }
-        data = {
-            "fb_dtsg": [fb_dtsg],
-            "variables": json.dumps({"media_id": thread_id, "repost_context": None}),
-            "server_timestamps": ["true"],
-            "doc_id": [Constants.DOC_IDS["UNREPOST"]],
-        }
-
-        response = self.__send_request_with_auth(
-            method="POST",
-            url=Constants.BASE_URL + Constants.GRAPHQL_ENDPOINT,
-            headers={**Constants.BASIC_HEADERS, **addional_headers},
-            data=data,
-        )
+    def repost(self, thread_id):
+        return self.__perform_action("REPOST", thread_id, "repost")
 
-        if not response.json().get("errors"):
-            print("Thread unreposted successfully!")
-            return True
-        else:
-            print(response.json())
-            print("Failed to unrepost thread!")
-            return False
+    @login_required
+    def unrepost(self, thread_id):
+        return self.__perform_action("UNREPOST", thread_id, "unrepost")
 
     @login_required
     def follow(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"target_user_id": user_id}),
-            doc_id=Constants.DOC_IDS["FOLLOW"],
-            action_name="follow",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "FOLLOW", "follow")
 
     @login_required
     def unfollow(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"target_user_id": user_id}),
-            doc_id=Constants.DOC_IDS["UNFOLLOW"],
-            action_name="unfollow",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "UNFOLLOW", "unfollow")
 
     @login_required
     def block(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"user_id": user_id}),
-            doc_id=Constants.DOC_IDS["BLOCK"],
-            action_name="block",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "BLOCK", "block")
 
     @login_required
     def unblock(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"user_id": user_id}),
-            doc_id=Constants.DOC_IDS["UNBLOCK"],
-            action_name="unblock",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "UNBLOCK", "unblock")
 
     @login_required
     def mute(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"author_id": user_id}),
-            doc_id=Constants.DOC_IDS["MUTE"],
-            action_name="mute",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "MUTE", "mute")
 
     @login_required
     def unmute(self, username: str = None, user_id: str = None):
-        if not username and not user_id:
-            raise ValueError("Either username or user_id is required")
-        if username:
-            user_id = self.get_user_id(username)
-        action = self.__perform_action(
-            variables=json.dumps({"author_id": user_id}),
-            doc_id=Constants.DOC_IDS["UNMUTE"],
-            action_name="unmute",
-        )
-        print(action)
+        return self.__perform_user_action(username, user_id, "UNMUTE", "unmute")
@@ -0,0 +1,528 @@
+"""Media preprocessing before upload.
+
+`ImagePreprocessor` downscales images to the largest size Threads displays,
+re-encodes them as JPEG or WebP and drops their metadata, in worker processes.
+`VideoPreprocessor` transcodes videos to a target size and bitrate with the
+ffmpeg binary moviepy uses, and extracts a cover frame. `MediaPreprocessor`
+combines both for a client.
+
+Results are written to an output directory named after the content of the
+source file and the settings, so preparing the same file twice only costs a
+lookup.
+
+Usage:
+    preprocessor = MediaPreprocessor(ImagePreprocessor(), VideoPreprocessor())
+    threads = Threads(username, password, preprocessor=preprocessor)
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from probe import probe_dimensions
+
+HASH_CHUNK_SIZE = 1024 * 1024
+STREAM_PATTERN = re.compile(r"Stream #\d+:\d+.*?: (Video|Audio): (\w+)(.*)")
+DEFAULT_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "threads-media")
+
+
+def file_digest(path):
+    """Returns the BLAKE2b digest of a file, as used by `MediaCache`."""
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _process_image(path, output_path, max_dimension, format, quality):
+    """Runs in a worker process. Returns the (width, height) of the written image."""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as source:
+        # Lets the JPEG decoder scale down by up to 8x while decoding.
+        source.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(source)
+        icc_profile = source.info.get("icc_profile")
+        modes = ("RGB", "RGBA") if format == "WEBP" else ("RGB",)
+        if image.mode not in modes:
+            if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+                image = image.convert("RGBA")
+                if format == "JPEG":
+                    background = Image.new("RGB", image.size, (255, 255, 255))
+                    background.paste(image, mask=image.getchannel("A"))
+                    image = background
+            else:
+                image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        # Only the color profile is carried over, EXIF, XMP and comments are dropped.
+        options = {"quality": quality, "icc_profile": icc_profile}
+        if format == "JPEG":
+            # Pillow carries the source comment over unless it is overridden.
+            options.update(optimize=True, progressive=True, comment=b"")
+        temporary = f"{output_path}.{os.getpid()}.tmp"
+        image.save(temporary, format, **options)
+        os.replace(temporary, output_path)
+        return image.size
+
+
+def _bits_per_second(bitrate):
+    """Parses an ffmpeg bitrate such as "3500k" or "4M"."""
+    bitrate = str(bitrate).strip().lower()
+    multiplier = {"k": 1000, "m": 1000**2}.get(bitrate[-1:], 1)
+    return int(float(bitrate.rstrip("km")) * multiplier)
+
+
+def _run_ffmpeg(arguments, path):
+    from moviepy.config import get_setting
+
+    command = [get_setting("FFMPEG_BINARY"), "-hide_banner", "-y", *arguments]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode:
+        error = result.stderr.decode(errors="replace").strip().splitlines()[-1:]
+        raise ValueError(f"ffmpeg failed on {path}: {' '.join(error)}")
+
+
+def _probe_streams(path):
+    """Returns the codec and details of the first video and audio stream of a file.
+
+    Returns:
+    dict: "Video" and "Audio" to a (codec, details) tuple, for the streams found.
+    """
+    from moviepy.config import get_setting
+
+    command = [get_setting("FFMPEG_BINARY"), "-hide_banner", "-i", path]
+    # Without an output file ffmpeg exits with an error after printing the streams.
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    streams = {}
+    for line in result.stderr.decode(errors="replace").splitlines():
+        match = STREAM_PATTERN.search(line)
+        if match:
+            streams.setdefault(match.group(1), (match.group(2), match.group(3)))
+    return streams
+
+
+def _can_copy(path):
+    """Whether a video is already H.264 in 4:2:0 with AAC or no audio."""
+    streams = _probe_streams(path)
+    video, details = streams.get("Video", (None, ""))
+    audio, _ = streams.get("Audio", ("aac", ""))
+    return (
+        video == "h264"
+        and re.search(r", yuv420p\b", details) is not None
+        and audio == "aac"
+    )
+
+
+def _process_video(
+    path,
+    output_path,
+    cover_path,
+    max_dimension,
+    video_bitrate,
+    audio_bitrate,
+    preset,
+    threads,
+    cover_time,
+):
+    """Runs in a worker thread, ffmpeg does the work in its own process.
+
+    Returns the (width, height) of the written video, as displayed.
+    """
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    try:
+        infos = ffmpeg_parse_infos(path)
+    except OSError as e:
+        raise ValueError(f"Cannot read the video {path}") from e
+    # The header probe applies the full track matrix, moviepy only reads a
+    # rotate tag that recent ffmpeg versions no longer print.
+    dimensions = probe_dimensions(path)
+    if dimensions:
+        width, height = dimensions
+    else:
+        width, height = infos["video_size"]
+        if infos.get("video_rotation") in (90, 270):
+            width, height = height, width
+    duration = infos.get("duration") or 0
+    longer = max(width, height)
+    target = _bits_per_second(video_bitrate)
+    source = os.path.getsize(path) * 8 / duration if duration else None
+
+    temporary = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if (
+        longer <= max_dimension
+        and source
+        and source <= target * 1.1
+        and _can_copy(path)
+    ):
+        # Small enough already, only rewritten with the index up front.
+        arguments = ["-i", path, "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy"]
+    else:
+        # ffmpeg rotates the frames before filtering, so the filter sees the
+        # displayed orientation. -2 keeps the aspect ratio with an even size,
+        # which H.264 needs.
+        size = max(2, min(longer, max_dimension) // 2 * 2)
+        scale = f"{size}:-2" if width >= height else f"-2:{size}"
+        arguments = [
+            "-i",
+            path,
+            "-map",
+            "0:v:0",
+            "-map",
+            "0:a:0?",
+            "-vf",
+            f"scale={scale}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            preset,
+            "-b:v",
+            str(target),
+            "-maxrate",
+            str(target),
+            "-bufsize",
+            str(2 * target),
+            "-pix_fmt",
+            "yuv420p",
+            "-c:a",
+            "aac",
+            "-b:a",
+            str(audio_bitrate),
+            "-threads",
+            str(threads),
+        ]
+    arguments += ["-map_metadata", "-1", "-movflags", "+faststart"]
+    _run_ffmpeg([*arguments, "-f", "mp4", temporary], path)
+    os.replace(temporary, output_path)
+
+    if cover_path:
+        seek = min(cover_time, duration / 2) if duration else 0
+        cover = ["-ss", str(seek), "-i", output_path, "-frames:v", "1", "-q:v", "3"]
+        _run_ffmpeg([*cover, "-f", "image2", temporary], path)
+        os.replace(temporary, cover_path)
+    # Read back rather than computed, a copied stream keeps its rotation.
+    dimensions = probe_dimensions(output_path)
+    if not dimensions:
+        raise ValueError(f"Cannot read the dimensions of {output_path}")
+    return dimensions
+
+
+class PreparedMedia:
+    """A file ready for upload, with the dimensions it was written with."""
+
+    def __init__(self, path, mime_type, width, height, cover_path=None):
+        self.path = path
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.cover_path = cover_path
+
+    def __repr__(self):
+        return f"<PreparedMedia {self.path} {self.width}x{self.height}>"
+
+
+class Preprocessor:
+    """Base class of the preprocessors: output naming, caching and the executor."""
+
+    EXTENSION = None
+    MIME_TYPE = None
+
+    def __init__(self, output_dir, max_workers, executor):
+        self.output_dir = output_dir
+        self.max_workers = max_workers
+        self.__executor = executor
+        self.__owns_executor = executor is None
+        self.__lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers)
+
+    @property
+    def executor(self):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = self.create_executor()
+            return self.__executor
+
+    def settings(self):
+        """Returns the settings that change the output, as a list."""
+        raise NotImplementedError
+
+    def accepts(self, mime_type):
+        raise NotImplementedError
+
+    def output_path(self, digest):
+        """Returns where the prepared version of a content is stored."""
+        key = ":".join(str(setting) for setting in [digest, *self.settings()])
+        name = hashlib.blake2b(key.encode(), digest_size=20).hexdigest()
+        return os.path.join(self.output_dir, f"{name}.{self.EXTENSION}")
+
+    def cached(self, output_path):
+        """Returns the `PreparedMedia` of an existing output, or None."""
+        dimensions = os.path.exists(output_path) and probe_dimensions(output_path)
+        if not dimensions:
+            return None
+        return PreparedMedia(output_path, self.MIME_TYPE, *dimensions)
+
+    def start(self, path, output_path):
+        """Submits the job writing `output_path`.
+
+        Returns:
+        tuple: The future of the job, resolving to the output dimensions, and a function building the `PreparedMedia` from them.
+        """
+        raise NotImplementedError
+
+    def submit(self, path, digest=None):
+        """Starts preparing a file.
+
+        Args:
+        path (str): The source file.
+        digest (str): The BLAKE2b digest of the source, computed if omitted.
+
+        Returns:
+        Future: Resolves to a `PreparedMedia`.
+        """
+        output_path = self.output_path(digest or file_digest(path))
+        future = Future()
+        prepared = self.cached(output_path)
+        if prepared:
+            future.set_result(prepared)
+            return future
+        job, result = self.start(path, output_path)
+
+        def done(job):
+            try:
+                width, height = job.result()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result(width, height))
+
+        job.add_done_callback(done)
+        return future
+
+    def prepare(self, path, digest=None):
+        """Prepares a file and waits for the result.
+
+        Returns:
+        PreparedMedia: The prepared file and its dimensions.
+        """
+        return self.submit(path, digest).result()
+
+    def prepare_many(self, paths):
+        """Prepares many files in parallel, keeping the order."""
+        futures = [self.submit(path) for path in paths]
+        return [future.result() for future in futures]
+
+    def close(self):
+        with self.__lock:
+            if self.__owns_executor and self.__executor is not None:
+                self.__executor.shutdown()
+                self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ImagePreprocessor(Preprocessor):
+    """Downscales and re-encodes images on a process pool.
+
+    Images larger than `max_dimension` on their longer side are scaled down,
+    orientation from EXIF is applied, and the image is saved without metadata
+    at `quality`. Images with transparency are put on a white background when
+    saved as JPEG.
+    """
+
+    FORMATS = {"JPEG": ("jpg", "image/jpeg"), "WEBP": ("webp", "image/webp")}
+    # Re-encoding would drop the animation.
+    SKIPPED_TYPES = {"image/gif"}
+
+    def __init__(
+        self,
+        max_dimension=1440,
+        format="JPEG",
+        quality=85,
+        output_dir=DEFAULT_OUTPUT_DIR,
+        max_workers=None,
+        executor=None,
+    ):
+        """Initializes a new image preprocessor.
+
+        Args:
+        max_dimension (int): Maximum width and height of the output in pixels.
+        format (str): "JPEG" or "WEBP".
+        quality (int): Encoder quality, 1-100.
+        output_dir (str): Where prepared images are written and looked up.
+        max_workers (int): Number of worker processes. Defaults to the number of CPUs.
+        executor (concurrent.futures.Executor): Executor to use instead of a private process pool.
+        """
+        format = format.upper()
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported output format: {format}")
+        super().__init__(output_dir, max_workers, executor)
+        self.max_dimension = max_dimension
+        self.format = format
+        self.quality = quality
+        self.EXTENSION, self.MIME_TYPE = self.FORMATS[format]
+
+    def settings(self):
+        return [self.max_dimension, self.format, self.quality]
+
+    def accepts(self, mime_type):
+        return mime_type.startswith("image/") and mime_type not in self.SKIPPED_TYPES
+
+    def start(self, path, output_path):
+        job = self.executor.submit(
+            _process_image,
+            path,
+            output_path,
+            self.max_dimension,
+            self.format,
+            self.quality,
+        )
+        return job, lambda width, height: PreparedMedia(
+            output_path, self.MIME_TYPE, width, height
+        )
+
+
+class VideoPreprocessor(Preprocessor):
+    """Transcodes videos to H.264/AAC MP4 and extracts a cover frame.
+
+    Videos larger than `max_dimension` on their longer side or above
+    `video_bitrate` are transcoded. Others are only remuxed, so that the index
+    comes first. Each job runs one ffmpeg process, so the jobs are driven from
+    a thread pool and ffmpeg spreads them over the cores, with `threads` encoder
+    threads each.
+    """
+
+    EXTENSION = "mp4"
+    MIME_TYPE = "video/mp4"
+
+    def __init__(
+        self,
+        max_dimension=1920,
+        video_bitrate="3500k",
+        audio_bitrate="128k",
+        preset="veryfast",
+        cover=True,
+        cover_time=1.0,
+        output_dir=DEFAULT_OUTPUT_DIR,
+        max_workers=2,
+        threads=None,
+        executor=None,
+    ):
+        """Initializes a new video preprocessor.
+
+        Args:
+        max_dimension (int): Maximum width and height of the output in pixels.
+        video_bitrate (str): Target video bitrate, e.g. "3500k".
+        audio_bitrate (str): Target audio bitrate.
+        preset (str): x264 preset, trading encoding speed for size.
+        cover (bool): Whether to extract a cover frame, uploaded instead of letting the server pick one.
+        cover_time (float): Position of the cover frame in seconds, at most half of the video.
+        output_dir (str): Where prepared videos are written and looked up.
+        max_workers (int): Number of videos transcoded at once.
+        threads (int): Encoder threads per video. Defaults to the CPUs divided by `max_workers`.
+        executor (concurrent.futures.Executor): Executor to use instead of a private thread pool.
+        """
+        super().__init__(output_dir, max_workers, executor)
+        self.max_dimension = max_dimension
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+        self.preset = preset
+        self.cover = cover
+        self.cover_time = cover_time
+        self.threads = threads or max(1, (os.cpu_count() or 1) // max_workers)
+
+    def create_executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def settings(self):
+        return [
+            self.max_dimension,
+            self.video_bitrate,
+            self.audio_bitrate,
+            self.preset,
+            self.cover_time,
+        ]
+
+    def accepts(self, mime_type):
+        return mime_type.startswith("video/")
+
+    def cover_path(self, output_path):
+        if not self.cover:
+            return None
+        return output_path[: -len(self.EXTENSION)] + "jpg"
+
+    def cached(self, output_path):
+        cover_path = self.cover_path(output_path)
+        if cover_path and not os.path.exists(cover_path):
+            return None
+        prepared = super().cached(output_path)
+        if prepared:
+            prepared.cover_path = cover_path
+        return prepared
+
+    def start(self, path, output_path):
+        cover_path = self.cover_path(output_path)
+        job = self.executor.submit(
+            _process_video,
+            path,
+            output_path,
+            cover_path,
+            self.max_dimension,
+            self.video_bitrate,
+            self.audio_bitrate,
+            self.preset,
+            self.threads,
+            self.cover_time,
+        )
+        return job, lambda width, height: PreparedMedia(
+            output_path, self.MIME_TYPE, width, height, cover_path
+        )
+
+
+class MediaPreprocessor:
+    """Sends each file to the first of its preprocessors that accepts its type."""
+
+    def __init__(self, *preprocessors):
+        self.preprocessors = [p for p in preprocessors if p is not None]
+
+    def __find(self, mime_type):
+        for preprocessor in self.preprocessors:
+            if preprocessor.accepts(mime_type):
+                return preprocessor
+        return None
+
+    def accepts(self, mime_type):
+        return self.__find(mime_type) is not None
+
+    def submit(self, path, digest=None):
+        mime_type, _ = mimetypes.guess_type(path)
+        preprocessor = self.__find(mime_type or "")
+        if preprocessor is None:
+            raise ValueError(f"No preprocessor accepts {path}")
+        return preprocessor.submit(path, digest)
+
+    def prepare(self, path, digest=None):
+        return self.submit(path, digest).result()
+
+    def close(self):
+        for preprocessor in self.preprocessors:
+            preprocessor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,137 @@
+"""Header-only media probing.
+
+Reads the width and height of images and videos straight from their container
+headers, without decoding pixels or starting ffmpeg. Supported formats are
+JPEG, PNG, GIF, WebP and MP4/MOV (ISO base media) files.
+"""
+
+import os
+import struct
+from functools import lru_cache
+
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+MP4_CONTAINER_BOXES = {b"moov", b"trak"}
+MAX_JPEG_SEGMENTS = 1000
+
+
+def probe_dimensions(path):
+    """Returns the (width, height) of a media file, or None if it cannot be read.
+
+    Results are cached per path, modification time and size, so a file that
+    changes on disk is probed again.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return _probe_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=4096)
+def _probe_cached(path, mtime_ns, size):
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            f.seek(0)
+            if head.startswith(b"\x89PNG\r\n\x1a\n"):
+                return _probe_png(head)
+            if head.startswith((b"GIF87a", b"GIF89a")):
+                return struct.unpack("<HH", head[6:10])
+            if head.startswith(b"\xff\xd8"):
+                return _probe_jpeg(f)
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                return _probe_webp(f.read(30))
+            if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+                return _probe_mp4(f, size)
+    except (OSError, struct.error, ValueError):
+        pass
+    return None
+
+
+def _probe_png(head):
+    if head[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", head[16:24])
+
+
+def _probe_jpeg(f):
+    f.read(2)
+    for _ in range(MAX_JPEG_SEGMENTS):
+        byte = f.read(1)
+        while byte and byte != b"\xff":
+            byte = f.read(1)
+        while byte == b"\xff":
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            continue
+        if marker in (0xD9, 0xDA):
+            return None
+        (length,) = struct.unpack(">H", f.read(2))
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+    return None
+
+
+def _probe_webp(data):
+    chunk, payload = data[12:16], data[20:]
+    if chunk == b"VP8 " and payload[3:6] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", payload[6:10])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and payload[0] == 0x2F:
+        (bits,) = struct.unpack("<I", payload[1:5])
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(payload[4:7], "little") + 1
+        height = int.from_bytes(payload[7:10], "little") + 1
+        return width, height
+    return None
+
+
+def _probe_mp4(f, end):
+    """Walks the box tree and returns the size of the first visual track."""
+    stack = [end]
+    while stack:
+        position = f.tell()
+        if position + 8 > stack[-1]:
+            f.seek(stack.pop())
+            continue
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header_size = 16
+        elif size == 0:
+            size = stack[-1] - position
+        if size < header_size:
+            return None
+        box_end = position + size
+        if box_type in MP4_CONTAINER_BOXES:
+            stack.append(box_end)
+            continue
+        if box_type == b"tkhd":
+            dimensions = _parse_tkhd(f.read(size - header_size))
+            if dimensions:
+                return dimensions
+        f.seek(box_end)
+    return None
+
+
+def _parse_tkhd(data):
+    version = data[0]
+    # Skip version/flags, times, track id, reserved and duration, then the
+    # reserved, layer, alternate group, volume and reserved fields.
+    offset = (36 if version == 1 else 24) + 16
+    matrix = struct.unpack(">9i", data[offset : offset + 36])
+    width, height = struct.unpack(">II", data[offset + 36 : offset + 44])
+    width, height = width >> 16, height >> 16
+    if not width or not height:
+        return None
+    # A 90 or 270 degree rotation swaps the displayed width and height.
+    if matrix[0] == 0 and matrix[4] == 0:
+        width, height = height, width
+    return width, height
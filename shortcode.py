@@ -0,0 +1,103 @@
+"""Shortcode <-> media id conversion.
+
+Threads and Instagram posts are addressed by a base64-like shortcode in URLs
+(`https://www.threads.net/@user/post/CuXFPIeLLod`) and by a numeric media id in
+the API. Mutations on a post take a `<media id>_<author id>` post id.
+"""
+
+import re
+
+ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+# Private posts append extra characters to the shortcode; the media id is
+# always encoded in the first 11.
+MAX_SHORTCODE_LENGTH = 11
+
+DECODE_TABLE = {char: value for value, char in enumerate(ALPHABET)}
+# Two characters (12 bits) per lookup when encoding.
+ENCODE_TABLE = [a + b for a in ALPHABET for b in ALPHABET]
+
+URL_PATTERN = re.compile(r"/(?:p|t|post|reel|reels|tv)/([A-Za-z0-9_-]+)")
+# All-digit values are media ids. Shortcodes of real posts start with a letter,
+# only a short shortcode could be all digits.
+MEDIA_ID_PATTERN = re.compile(r"\d+")
+POST_ID_PATTERN = re.compile(r"(\d+)_(\d+)")
+
+
+def extract_shortcode(value):
+    """Returns the shortcode of a post URL, or `value` itself if it is not a URL."""
+    if "/" in value:
+        match = URL_PATTERN.search(value)
+        if not match:
+            raise ValueError(f"No shortcode found in URL: {value}")
+        value = match.group(1)
+    return value[:MAX_SHORTCODE_LENGTH]
+
+
+def decode(shortcode):
+    """Converts a shortcode or post URL to a media id.
+
+    Returns:
+    str: The numeric media id.
+    """
+    table = DECODE_TABLE
+    media_id = 0
+    try:
+        for char in extract_shortcode(shortcode):
+            media_id = (media_id << 6) | table[char]
+    except KeyError as error:
+        raise ValueError(f"Invalid shortcode: {shortcode}") from error
+    return str(media_id)
+
+
+def encode(media_id):
+    """Converts a media id, or a `<media id>_<user id>` post id, to a shortcode."""
+    media_id = str(media_id).split("_", 1)[0]
+    if not media_id.isdigit():
+        raise ValueError(f"Invalid media id: {media_id}")
+    value = int(media_id)
+    table = ENCODE_TABLE
+    pairs = []
+    while value:
+        pairs.append(table[value & 0xFFF])
+        value >>= 12
+    return "".join(reversed(pairs)).lstrip("A") or "A"
+
+
+def decode_many(shortcodes):
+    """Converts a list of shortcodes or post URLs to media ids, keeping the order."""
+    return [decode(shortcode) for shortcode in shortcodes]
+
+
+def encode_many(media_ids):
+    """Converts a list of media ids or post ids to shortcodes, keeping the order."""
+    return [encode(media_id) for media_id in media_ids]
+
+
+def to_media_id(value):
+    """Normalizes a media id, post id, shortcode or post URL to a media id."""
+    value = str(value)
+    if MEDIA_ID_PATTERN.fullmatch(value):
+        return value
+    match = POST_ID_PATTERN.fullmatch(value)
+    if match:
+        return match.group(1)
+    return decode(value)
+
+
+def to_post_id(value, user_id):
+    """Builds the `<media id>_<user id>` form used by post mutations.
+
+    Values that already carry a user id are returned unchanged.
+    """
+    value = str(value)
+    if POST_ID_PATTERN.fullmatch(value):
+        return value
+    return f"{to_media_id(value)}_{user_id}"
+
+
+def split_post_id(post_id):
+    """Splits a `<media id>_<user id>` post id into its media and user ids."""
+    match = POST_ID_PATTERN.fullmatch(str(post_id))
+    if not match:
+        raise ValueError(f"Invalid post id: {post_id}")
+    return match.group(1), match.group(2)
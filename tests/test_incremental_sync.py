@@ -0,0 +1,67 @@
+from main import IncrementalSync, WatermarkStore
+
+
+class Feed:
+    """Newest-first feed with cursors that stay valid when items are added."""
+
+    def __init__(self, count):
+        self.items = [{"id": i, "timestamp": i} for i in range(count, 0, -1)]
+
+    def add(self, count):
+        newest = self.items[0]["id"]
+        self.items[:0] = [
+            {"id": i, "timestamp": i} for i in range(newest + count, newest, -1)
+        ]
+
+    def iter_pages(self, cursor=None, page_size=20, max_pages=None):
+        rest = [
+            item for item in self.items if cursor is None or item["id"] < int(cursor)
+        ]
+        pages = 0
+        while rest and (max_pages is None or pages < max_pages):
+            page, rest = rest[:page_size], rest[page_size:]
+            pages += 1
+            yield page, str(page[-1]["id"])
+
+
+def poll_until_idle(sync, polls=20):
+    sent = []
+    for _ in range(polls):
+        sent += [item["id"] for item in sync.poll()]
+    return sent
+
+
+def test_backfill_across_polls_sends_each_item_once():
+    feed = Feed(1500)
+    store = WatermarkStore(":memory:")
+    sync = IncrementalSync(feed.iter_pages, store, "account")
+
+    sent = poll_until_idle(sync)
+
+    assert sorted(sent) == list(range(1, 1501))
+    cursor, watermark, pending, _ = store.load("account")
+    assert (cursor, watermark, pending) == (None, 1500, None)
+
+
+def test_items_added_during_backfill_are_sent_once():
+    feed = Feed(500)
+    store = WatermarkStore(":memory:")
+    sync = IncrementalSync(feed.iter_pages, store, "account", max_pages=3)
+
+    sent = [item["id"] for item in sync.poll()]
+    feed.add(30)
+    sent += poll_until_idle(sync)
+
+    assert sorted(sent) == list(range(1, 531))
+    assert store.load("account")[1] == 530
+
+
+def test_seen_ids_are_trimmed_by_item_timestamp():
+    feed = Feed(300)
+    store = WatermarkStore(":memory:", max_seen=50)
+    sync = IncrementalSync(feed.iter_pages, store, "account", max_pages=2)
+
+    poll_until_idle(sync)
+
+    seen_ids = store.load("account")[3]
+    assert seen_ids == {str(i) for i in range(251, 301)}
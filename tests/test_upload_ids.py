@@ -0,0 +1,26 @@
+import time
+
+from main import UploadIdGenerator
+
+
+def test_ids_fit_in_63_bits_until_the_epoch_runs_out():
+    generator = UploadIdGenerator(worker_id=UploadIdGenerator.MAX_WORKER_ID)
+    upload_id = generator.next()
+    assert upload_id.bit_length() <= 63
+    # 41 bits of milliseconds last about 69 years from the epoch.
+    last_ms = (1 << 41) - 1 + UploadIdGenerator.EPOCH_MS
+    assert time.gmtime(last_ms / 1000).tm_year >= 2093
+
+
+def test_ids_are_strictly_increasing():
+    generator = UploadIdGenerator(worker_id=7)
+    ids = [generator.next() for _ in range(20000)]
+    assert all(a < b for a, b in zip(ids, ids[1:]))
+
+
+def test_parse_returns_unix_milliseconds_worker_and_sequence():
+    generator = UploadIdGenerator(worker_id=42)
+    before = int(time.time() * 1000)
+    timestamp, worker_id, sequence = UploadIdGenerator.parse(generator.next())
+    assert before <= timestamp <= int(time.time() * 1000) + 1
+    assert (worker_id, sequence) == (42, 0)